@@ -1,13 +1,17 @@
-from ninja import NinjaAPI
+from collections import Counter
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from ninja import NinjaAPI, Query, Schema
 from chat.api import router as chat_router
-from auth.auth import jwt_bearer_auth
+from auth.auth import async_jwt_bearer_auth
 from auth.api import router as auth_router
 from userprofile.api import router as profile_router
-from llms.providers import get_providers_and_models
+from llms.catalog import model_catalog
 from llms.tools import available_tools
 
 
-api = NinjaAPI(auth=jwt_bearer_auth)
+# All views are async - sync views would need a sync authenticator (auth.auth.jwt_bearer_auth)
+api = NinjaAPI(auth=async_jwt_bearer_auth)
 
 
 api.add_router("/chats", chat_router, tags=["chats"])
@@ -16,18 +20,65 @@ api.add_router("/", profile_router, tags=["profile"])
 
 
 @api.get("/settings")
-def get_settings(request):
+async def get_settings(request):
     """Get application settings."""
     return {"language": "en"}
 
 
 @api.get("/models")
-def get_models(request):
-    """Get list of available LLM models grouped by provider."""
-    return get_providers_and_models()
+async def get_models(request):
+    """Get list of available LLM models grouped by provider (snapshot refreshed in the background)."""
+    catalog = await model_catalog.get()
+    headers = {'ETag': catalog.etag, 'Cache-Control': 'private, no-cache'}
+    conditional = get_conditional_response(request, etag=catalog.etag)
+    if conditional is not None:
+        for header, value in headers.items():
+            conditional[header] = value
+        return conditional
+    return HttpResponse(catalog.content, content_type='application/json', headers=headers)
+
+
+class CatalogModelSchema(Schema):
+    id: str
+    name: str
+    description: str
+    provider: str
+    context_length: int | None = None
+    prompt_price: float | None = None  # USD per million tokens
+    completion_price: float | None = None
+
+
+class ModelSearchSchema(Schema):
+    count: int
+    provider_counts: dict[str, int]  # matches per provider, ignoring the provider filter
+    items: list[CatalogModelSchema]
+
+
+@api.get("/models/search", response=ModelSearchSchema)
+async def search_models(
+    request,
+    q: str = '',
+    provider: list[str] = Query(None),
+    min_context_length: int | None = None,
+    max_prompt_price: float | None = None,
+    limit: int = 50,
+    offset: int = 0,
+):
+    """Search the model catalog by name, id and description (word prefixes), filtered and paginated."""
+    index = (await model_catalog.get()).index
+    positions = index.search(q, None, min_context_length, max_prompt_price)
+    provider_counts = Counter(index.providers[position] for position in positions)
+    if provider:
+        positions = [position for position in positions if index.providers[position] in provider]
+    limit = min(max(limit, 0), 100)
+    return {
+        'count': len(positions),
+        'provider_counts': provider_counts,
+        'items': [index.models[position] for position in positions[max(offset, 0) : max(offset, 0) + limit]],
+    }
 
 
 @api.get("/tools")
-def get_tools(request):
+async def get_tools(request):
     """Get list of available tools."""
     return {key: {"name": tool["name"]} for key, tool in available_tools.items()}
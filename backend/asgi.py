@@ -1,4 +1,7 @@
 import os
+import asyncio
+from dataclasses import dataclass, field
+from email.utils import formatdate, parsedate_to_datetime
 from pathlib import Path
 from mimetypes import guess_type
 from django.core.asgi import get_asgi_application
@@ -11,12 +14,111 @@ INDEX_HTML_PATH = STATIC_ROOT / 'index.html'
 
 django_app = get_asgi_application()
 
+CHUNK_SIZE = 64 * 1024
+MEMORY_MAX_SIZE = 256 * 1024  # files up to this size are kept in memory
+IMMUTABLE_PREFIXES = ('/_nuxt/',)  # Nuxt build assets have content hashes in their names
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))  # precompressed variants, in order of preference
+
+
+@dataclass
+class StaticVariant:
+    path: Path
+    size: int
+    etag: str
+    content: bytes | None = None  # small files are served from memory
+
+
+@dataclass
+class StaticFile:
+    content_type: str
+    last_modified: str
+    mtime: int
+    cache_control: str
+    variants: dict[str, StaticVariant] = field(default_factory=dict)  # encoding ('' - identity) -> variant
+
+
+def load_variant(path: Path, etag: str) -> StaticVariant:
+    stat = path.stat()
+    content = path.read_bytes() if stat.st_size <= MEMORY_MAX_SIZE else None
+    return StaticVariant(path, stat.st_size, etag, content)
+
+
+def build_manifest(static_dir: Path, index_path: Path) -> dict[str, StaticFile]:
+    """URL path -> StaticFile for everything under static_dir (built once at startup)."""
+    manifest = {}
+    for root, _dirs, files in os.walk(static_dir):
+        for name in files:
+            path = Path(root) / name
+            if path.suffix in ('.br', '.gz') and path.with_suffix('').is_file():
+                continue  # variant of another file
+            url = '/' + path.relative_to(static_dir).as_posix()
+            stat = path.stat()
+            etag = f'"{int(stat.st_mtime):x}-{stat.st_size:x}"'
+            mime, _ = guess_type(str(path))
+            if path == index_path:
+                cache_control = 'no-cache'
+            elif url.startswith(IMMUTABLE_PREFIXES):
+                cache_control = 'public, max-age=31536000, immutable'
+            else:
+                cache_control = 'public, max-age=0, must-revalidate'
+            static_file = StaticFile(
+                content_type=mime or 'application/octet-stream',
+                last_modified=formatdate(stat.st_mtime, usegmt=True),
+                mtime=int(stat.st_mtime),
+                cache_control=cache_control,
+            )
+            static_file.variants[''] = load_variant(path, etag)
+            for encoding, suffix in ENCODINGS:
+                variant_path = path.with_name(path.name + suffix)
+                if variant_path.is_file():
+                    static_file.variants[encoding] = load_variant(variant_path, f'{etag[:-1]}-{encoding}"')
+            manifest[url] = static_file
+    return manifest
+
+
+def get_header(scope, name: bytes) -> str:
+    for key, value in scope.get('headers', []):
+        if key == name:
+            return value.decode('latin-1')
+    return ''
+
+
+def accepted_encodings(accept_encoding: str) -> set[str]:
+    encodings = set()
+    for item in accept_encoding.split(','):
+        encoding, _, params = item.strip().partition(';')
+        if params.replace(' ', '') in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            continue
+        encodings.add(encoding.strip().lower())
+    return encodings
+
+
+def not_modified(scope, static_file: StaticFile, variant: StaticVariant) -> bool:
+    if_none_match = get_header(scope, b'if-none-match')
+    if if_none_match:
+        tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+        return '*' in tags or variant.etag in tags
+    if_modified_since = get_header(scope, b'if-modified-since')
+    if if_modified_since:
+        try:
+            return static_file.mtime <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
 
 class StaticAndSPAFallback:
+    """Serves the built frontend (and collected static files) from a manifest made at startup.
+
+    Files added to static_dir later are not served until restart - it only changes on deploy.
+    """
+
     def __init__(self, app, static_dir: Path, index_path: Path):
         self.app = app
         self.static_dir = static_dir
         self.index_path = index_path
+        self.manifest = build_manifest(static_dir, index_path) if static_dir.is_dir() else {}
+        self.index = self.manifest.get('/' + index_path.relative_to(static_dir).as_posix())
 
     async def __call__(self, scope, receive, send):
         path = scope.get("path", "")
@@ -29,54 +131,9 @@ class StaticAndSPAFallback:
         if path.startswith("/api") or path.startswith("/admin"):
             return await self.app(scope, receive, send)
 
-        # Try serving static file if it exists
-        static_file = self.static_dir / path.lstrip("/")
-        if static_file.exists() and static_file.is_file():
-            mime, _ = guess_type(str(static_file))
-            headers = [
-                (b"content-type", mime.encode() if mime else b"application/octet-stream"),
-                (b"content-length", str(static_file.stat().st_size).encode()),
-            ]
-            await send(
-                {
-                    "type": "http.response.start",
-                    "status": 200,
-                    "headers": headers,
-                }
-            )
-            with open(static_file, "rb") as f:
-                await send(
-                    {
-                        "type": "http.response.body",
-                        "body": f.read(),
-                        "more_body": False,
-                    }
-                )
-            return
-
-        # Fallback to index.html for SPA
-        if self.index_path.exists():
-            stat = self.index_path.stat()
-            headers = [
-                (b"content-type", b"text/html"),
-                (b"content-length", str(stat.st_size).encode()),
-            ]
-            await send(
-                {
-                    "type": "http.response.start",
-                    "status": 200,
-                    "headers": headers,
-                }
-            )
-            with open(self.index_path, "rb") as f:
-                await send(
-                    {
-                        "type": "http.response.body",
-                        "body": f.read(),
-                        "more_body": False,
-                    }
-                )
-        else:
+        # Static file from the manifest, otherwise index.html for SPA routes
+        static_file = self.manifest.get(path) or self.index
+        if static_file is None:
             await send(
                 {
                     "type": "http.response.start",
@@ -90,6 +147,49 @@ class StaticAndSPAFallback:
                     "body": b"index.html not found",
                 }
             )
+            return
+
+        await self.serve(scope, send, static_file)
+
+    async def serve(self, scope, send, static_file: StaticFile):
+        encodings = accepted_encodings(get_header(scope, b'accept-encoding'))
+        encoding = next((e for e, _suffix in ENCODINGS if e in static_file.variants and e in encodings), '')
+        variant = static_file.variants[encoding]
+
+        headers = [
+            (b"etag", variant.etag.encode()),
+            (b"last-modified", static_file.last_modified.encode()),
+            (b"cache-control", static_file.cache_control.encode()),
+        ]
+        if len(static_file.variants) > 1:
+            headers.append((b"vary", b"Accept-Encoding"))
+
+        if not_modified(scope, static_file, variant):
+            await send({"type": "http.response.start", "status": 304, "headers": headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        headers += [
+            (b"content-type", static_file.content_type.encode()),
+            (b"content-length", str(variant.size).encode()),
+        ]
+        if encoding:
+            headers.append((b"content-encoding", encoding.encode()))
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+
+        if scope.get("method") == "HEAD":
+            await send({"type": "http.response.body", "body": b""})
+        elif variant.content is not None:
+            await send({"type": "http.response.body", "body": variant.content})
+        elif "http.response.zerocopysend" in scope.get("extensions", {}):
+            with open(variant.path, "rb") as f:
+                await send({"type": "http.response.zerocopysend", "file": f, "count": variant.size})
+        else:
+            # Stream big files in chunks, disk reads off the event loop
+            with open(variant.path, "rb") as f:
+                while chunk := await asyncio.to_thread(f.read, CHUNK_SIZE):
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
 
 
 application = StaticAndSPAFallback(django_app, STATIC_ROOT, INDEX_HTML_PATH)
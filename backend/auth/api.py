@@ -1,7 +1,10 @@
+from asgiref.sync import sync_to_async
 from django.contrib.auth import authenticate
 from django.contrib.auth.models import User
 from ninja import Router, Schema
+from ninja.errors import HttpError
 from .auth import create_jwt_token
+from .user_cache import user_cache
 
 
 router = Router()
@@ -28,10 +31,11 @@ class ErrorSchema(Schema):
 
 
 @router.post("/login", response={200: AuthResponseSchema, 400: ErrorSchema}, auth=None)
-def login(request, data: LoginSchema):
+async def login(request, data: LoginSchema):
     """Login with email and password, return JWT token."""
     # Use email as username for authentication
-    user = authenticate(username=data.email, password=data.password)
+    # (password hashing is CPU heavy - runs in a thread, Django's aauthenticate would do it on the event loop)
+    user = await sync_to_async(authenticate)(username=data.email, password=data.password)
 
     if user is None:
         return 400, {"error": "Invalid email or password"}
@@ -42,14 +46,14 @@ def login(request, data: LoginSchema):
 
 
 @router.post("/register", response={200: AuthResponseSchema, 400: ErrorSchema}, auth=None)
-def register(request, data: RegisterSchema):
+async def register(request, data: RegisterSchema):
     """Register new user with email and password, return JWT token."""
     # Check if user already exists
-    if User.objects.filter(username=data.email).exists():
+    if await User.objects.filter(username=data.email).aexists():
         return 400, {"error": "User with this email already exists"}
 
-    # Create new user (username = email)
-    user = User.objects.create_user(username=data.email, email=data.email, password=data.password)
+    # Create new user (username = email), password hashing in a thread
+    user = await sync_to_async(User.objects.create_user)(username=data.email, email=data.email, password=data.password)
 
     token = create_jwt_token(user.id)
 
@@ -57,6 +61,14 @@ def register(request, data: RegisterSchema):
 
 
 @router.get("/check")
-def check_auth(request):
+async def check_auth(request):
     """Check authentication status - returns 200 if authenticated, 401/403 if not."""
     return {"authenticated": True}
+
+
+@router.get("/cache-stats")
+async def auth_cache_stats(request):
+    """Authentication cache metrics of this process (staff only)."""
+    if not request.auth.is_staff:
+        raise HttpError(403, "Staff only")
+    return user_cache.stats()
@@ -4,6 +4,7 @@ from typing import Optional
 from django.conf import settings
 from django.contrib.auth.models import User
 from ninja.security import APIKeyQuery, HttpBearer
+from auth.user_cache import user_cache
 
 
 def create_jwt_token(user_id: int) -> str:
@@ -23,21 +24,59 @@ def decode_jwt_token(token: str) -> dict | None:
         return None
 
 
-class BearerAuth(HttpBearer):
-    """JWT authentication via Authorization header (Bearer token)."""
-
-    def authenticate(self, request, token: str) -> Optional[User]:
-        # Decode JWT token (token is already extracted from "Bearer " prefix)
+def get_token_user_id(token: str) -> int | None:
+    """User id of a valid token - verified tokens are cached for a short time."""
+    user_id = user_cache.get_user_id(token)
+    if user_id is None:
         payload = decode_jwt_token(token)
         if not payload:
             return None
+        user_id = payload['user_id']
+        user_cache.put_user_id(token, user_id, payload.get('exp'))
+    return user_id
+
+
+def get_user(user_id: int) -> User | None:
+    user = user_cache.get_user(user_id)
+    if user is None:
+        try:
+            user = User.objects.get(id=user_id)
+        except User.DoesNotExist:
+            return None
+        user_cache.put_user(user)
+    return user
 
-        # Get user from payload
+
+async def aget_user(user_id: int) -> User | None:
+    user = user_cache.get_user(user_id)
+    if user is None:
         try:
-            user = User.objects.get(id=payload['user_id'])
-            return user
+            user = await User.objects.aget(id=user_id)
         except User.DoesNotExist:
             return None
+        user_cache.put_user(user)
+    return user
+
+
+class BearerAuth(HttpBearer):
+    """JWT authentication via Authorization header (Bearer token)."""
+
+    def authenticate(self, request, token: str) -> Optional[User]:
+        # Token is already extracted from "Bearer " prefix
+        user_id = get_token_user_id(token)
+        if user_id is None:
+            return None
+        return get_user(user_id)
+
+
+class AsyncBearerAuth(HttpBearer):
+    """JWT authentication via Authorization header for async views."""
+
+    async def authenticate(self, request, token: str) -> User | None:
+        user_id = get_token_user_id(token)
+        if user_id is None:
+            return None
+        return await aget_user(user_id)
 
 
 class QueryTokenAuth(APIKeyQuery):
@@ -48,20 +87,13 @@ class QueryTokenAuth(APIKeyQuery):
     async def authenticate(self, request, key: Optional[str]) -> Optional[User]:
         if not key:
             return None
-
-        # Decode JWT token
-        payload = decode_jwt_token(key)
-        if not payload:
-            return None
-
-        # Get user from payload
-        try:
-            user = await User.objects.aget(id=payload['user_id'])
-            return user
-        except User.DoesNotExist:
+        user_id = get_token_user_id(key)
+        if user_id is None:
             return None
+        return await aget_user(user_id)
 
 
 # Create the auth instances
 jwt_bearer_auth = BearerAuth()
+async_jwt_bearer_auth = AsyncBearerAuth()
 query_token_auth = QueryTokenAuth()
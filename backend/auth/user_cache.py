@@ -0,0 +1,107 @@
+import copy
+import time
+import threading
+from collections import OrderedDict
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
+
+
+class UserCache:
+    """Short-lived caches of verified JWT -> user id and user id -> User, shared by all authenticators.
+
+    Both are bounded LRUs with a TTL. Users are dropped on save/delete in this process, other
+    processes see changes after at most `ttl` seconds. Sync auth runs in threads, hence the lock.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self._tokens: OrderedDict[str, tuple[int, float]] = OrderedDict()  # token -> (user id, expires)
+        self._users: OrderedDict[int, tuple[User, float]] = OrderedDict()  # user id -> (user, expires)
+        self.token_hits = 0
+        self.token_misses = 0
+        self.user_hits = 0  # = DB queries saved
+        self.user_misses = 0
+
+    def _get(self, entries: OrderedDict, key):
+        entry = entries.get(key)
+        if entry is None:
+            return None
+        value, expires = entry
+        if expires <= time.monotonic():
+            del entries[key]
+            return None
+        entries.move_to_end(key)
+        return value
+
+    def _put(self, entries: OrderedDict, key, value, ttl: float):
+        entries[key] = (value, time.monotonic() + ttl)
+        entries.move_to_end(key)
+        while len(entries) > self.max_size:
+            entries.popitem(last=False)
+
+    def get_user_id(self, token: str) -> int | None:
+        with self.lock:
+            user_id = self._get(self._tokens, token)
+            if user_id is None:
+                self.token_misses += 1
+            else:
+                self.token_hits += 1
+            return user_id
+
+    def put_user_id(self, token: str, user_id: int, token_expires: float | None = None):
+        ttl = self.ttl
+        if token_expires is not None:
+            ttl = min(ttl, token_expires - time.time())  # never outlive the token
+        if ttl > 0:
+            with self.lock:
+                self._put(self._tokens, token, user_id, ttl)
+
+    def get_user(self, user_id: int) -> User | None:
+        with self.lock:
+            user = self._get(self._users, user_id)
+            if user is None:
+                self.user_misses += 1
+                return None
+            self.user_hits += 1
+        return copy.copy(user)  # views may modify request.auth
+
+    def put_user(self, user: User):
+        with self.lock:
+            self._put(self._users, user.id, copy.copy(user), self.ttl)
+
+    def discard_user(self, user_id: int):
+        with self.lock:
+            self._users.pop(user_id, None)
+
+    def clear(self):
+        with self.lock:
+            self._tokens.clear()
+            self._users.clear()
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.user_hits + self.user_misses
+            return {
+                'tokens': len(self._tokens),
+                'users': len(self._users),
+                'token_hits': self.token_hits,
+                'token_misses': self.token_misses,
+                'user_hits': self.user_hits,
+                'user_misses': self.user_misses,
+                'hit_rate': self.user_hits / lookups if lookups else 0.0,
+                'queries_saved': self.user_hits,
+            }
+
+
+user_cache = UserCache(max_size=settings.AUTH_CACHE_MAX_SIZE, ttl=settings.AUTH_CACHE_TTL)
+
+
+def user_changed(sender, instance: User, **kwargs):
+    user_cache.discard_user(instance.id)
+
+
+post_save.connect(user_changed, sender=User, dispatch_uid='auth.user_cache')
+post_delete.connect(user_changed, sender=User, dispatch_uid='auth.user_cache.delete')
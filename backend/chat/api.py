@@ -1,12 +1,20 @@
 import json
 import asyncio
-import os
+from datetime import datetime
 from ninja import Router, Schema, ModelSchema
+from ninja.errors import HttpError
 from ninja.files import UploadedFile
-from django.shortcuts import get_object_or_404, aget_object_or_404
+from django.conf import settings
+from django.db.models import Prefetch, Q
+from django.db.models.functions import Left
+from django.shortcuts import aget_object_or_404
+from django.urls import reverse
 from django.http import StreamingHttpResponse
-from chat.models import Chat, Prompt, File
+from chat.models import Chat, Prompt, File, Upload
 from chat.redis_pubsub import pubsub
+from chat.prompt_queue import aenqueue_prompt
+from chat.media import serve_file, sign_file_id, unsign_file_id
+from chat.uploads import complete_upload, delete_part, receive_chunk, start_upload, store_upload
 from auth.auth import query_token_auth
 
 
@@ -14,9 +22,11 @@ router = Router()
 
 
 class ChatListSchema(ModelSchema):
+    cursor: str  # pass as `after` to get chats older than this one
+
     class Meta:
         model = Chat
-        fields = ['id', 'uid', 'headline']
+        fields = ['id', 'uid', 'headline', 'timestamp']
 
 
 class FileSchema(ModelSchema):
@@ -26,10 +36,6 @@ class FileSchema(ModelSchema):
         model = File
         fields = ['id', 'media_type']
 
-    @staticmethod
-    def resolve_filename(obj):
-        return os.path.basename(obj.file.name)
-
 
 class PromptSchema(ModelSchema):
     files: list[FileSchema] = []
@@ -45,11 +51,16 @@ class PromptSchema(ModelSchema):
 
 class ChatDetailSchema(ModelSchema):
     prompts: list[PromptSchema]
+    has_more: bool = False  # older prompts exist before the returned window
 
     class Meta:
         model = Chat
         fields = ['id', 'uid', 'headline', 'model', 'timestamp']
 
+    @staticmethod
+    def resolve_prompts(obj):
+        return obj.prompt_window
+
 
 class CreateChatSchema(Schema):
     input_text: str
@@ -69,66 +80,133 @@ class CreatePromptSchema(Schema):
     file_ids: list[int] = []
 
 
+MAX_CHATS_LIMIT = 200
+MAX_PROMPTS_LIMIT = 200
+SUMMARY_TEXT_LENGTH = 300
+
+
+def chat_detail_queryset(limit: int | None = None, before: int | None = None, summary: bool = False):
+    """Chats with prompts and files prefetched for ChatDetailSchema (3 queries regardless of chat length).
+
+    With `limit` only the latest prompts (older than `before` prompt id) are loaded - one extra
+    row is fetched to tell if there are more (see get_prompt_window).
+    """
+    # llm_messages holds the whole model conversation and is never sent to the client
+    prompts = Prompt.objects.defer('llm_messages').prefetch_related('files')
+    if before:
+        prompts = prompts.filter(id__lt=before)
+    if summary:
+        prompts = prompts.defer('input_text', 'output_text').annotate(
+            input_summary=Left('input_text', SUMMARY_TEXT_LENGTH),
+            output_summary=Left('output_text', SUMMARY_TEXT_LENGTH),
+        )
+    if limit:
+        prompts = prompts.order_by('-id')[: limit + 1]
+    return Chat.objects.prefetch_related(Prefetch('prompts', queryset=prompts, to_attr='prompt_window'))
+
+
+async def get_prompt_window(limit: int | None = None, before: int | None = None, summary: bool = False, **filters):
+    if limit is not None:
+        limit = min(max(limit, 1), MAX_PROMPTS_LIMIT)
+    chat = await aget_object_or_404(chat_detail_queryset(limit, before, summary), **filters)
+    if limit:
+        chat.has_more = len(chat.prompt_window) > limit
+        chat.prompt_window = chat.prompt_window[:limit][::-1]
+    if summary:
+        for prompt in chat.prompt_window:
+            prompt.input_text = prompt.input_summary
+            prompt.output_text = prompt.output_summary
+    return chat
+
+
+def parse_chat_cursor(cursor: str) -> tuple[datetime, int]:
+    """Parse `<timestamp>_<id>` cursor of the last chat on the previous page (see list_chats)."""
+    try:
+        timestamp, chat_id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(timestamp), int(chat_id)
+    except ValueError:
+        raise HttpError(400, "Invalid cursor") from None
+
+
 @router.get("", response=list[ChatListSchema])
-def list_chats(request):
-    """List all chats for the authenticated user."""
-    chats = Chat.objects.filter(user=request.auth)
-    return [{"id": chat.id, "uid": chat.uid, "headline": chat.headline} for chat in chats]
+async def list_chats(request, limit: int = 50, after: str | None = None):
+    """List chats for the authenticated user, newest first.
+
+    Keyset pagination: pass `cursor` of the last chat as `after` to get the next page.
+    """
+    limit = min(max(limit, 1), MAX_CHATS_LIMIT)
+    chats = Chat.objects.filter(user=request.auth).order_by('-timestamp', '-id')
+    if after:
+        timestamp, chat_id = parse_chat_cursor(after)
+        chats = chats.filter(Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=chat_id))
+    result = [chat async for chat in chats.values('id', 'uid', 'headline', 'timestamp')[:limit]]
+    for chat in result:
+        # built here - JSON encoding of `timestamp` drops microseconds
+        chat['cursor'] = f"{chat['timestamp'].isoformat()}_{chat['id']}"
+    return result
 
 
 @router.post("", response=ChatResponseSchema)
-def create_chat(request, data: CreateChatSchema):
+async def create_chat(request, data: CreateChatSchema):
     """Create a new chat with initial prompt."""
     headline = data.input_text[:50]
-    chat = Chat.objects.create(
+    chat = await Chat.objects.acreate(
         headline=headline, model=data.model, user=request.auth, system_prompt=data.system_prompt, tools=data.tools
     )
 
-    prompt = Prompt.objects.create(chat=chat, input_text=data.input_text, status='queued')
+    prompt = await Prompt.objects.acreate(chat=chat, input_text=data.input_text, status='queued')
 
     # Add files if provided
     if data.file_ids:
-        files = File.objects.filter(id__in=data.file_ids, user=request.auth)
-        prompt.files.set(files)
+        files = [file async for file in File.objects.filter(id__in=data.file_ids, user=request.auth)]
+        await prompt.files.aset(files)
+
+    await aenqueue_prompt(prompt.id)
 
     return {"uid": chat.uid, "headline": chat.headline}
 
 
 @router.get("/{uid}", response=ChatDetailSchema)
-def get_chat(request, uid: str):
-    """Get chat details with all prompts for the authenticated user."""
-    chat = get_object_or_404(Chat, uid=uid, user=request.auth)
-    return chat
+async def get_chat(request, uid: str, limit: int | None = None, before: int | None = None, summary: bool = False):
+    """Get chat details with prompts for the authenticated user.
+
+    Pass `limit` to get only the latest prompts and `before=<prompt_id>` to page back in history,
+    `summary=true` truncates prompt texts.
+    """
+    return await get_prompt_window(limit=limit, before=before, summary=summary, uid=uid, user=request.auth)
 
 
 @router.post("/{uid}/prompts")
-def new_prompt(request, uid: str, data: CreatePromptSchema):
+async def new_prompt(request, uid: str, data: CreatePromptSchema):
     """Add a new prompt to an existing chat."""
-    chat = get_object_or_404(Chat, uid=uid, user=request.auth)
-    prompt = Prompt.objects.create(chat=chat, input_text=data.input_text, status='queued')
+    chat = await aget_object_or_404(Chat, uid=uid, user=request.auth)
+    prompt = await Prompt.objects.acreate(chat=chat, input_text=data.input_text, status='queued')
 
     # Add files if provided
     if data.file_ids:
-        files = File.objects.filter(id__in=data.file_ids, user=request.auth)
-        prompt.files.set(files)
+        files = [file async for file in File.objects.filter(id__in=data.file_ids, user=request.auth)]
+        await prompt.files.aset(files)
+
+    await aenqueue_prompt(prompt.id)
 
     return {"id": prompt.id, "status": prompt.status}
 
 
 @router.post("/{uid}/share")
-def share_chat(request, uid: str):
+async def share_chat(request, uid: str):
     """Share a chat publicly."""
-    chat = get_object_or_404(Chat, uid=uid, user=request.auth)
+    chat = await aget_object_or_404(Chat, uid=uid, user=request.auth)
     chat.is_shared = True
-    chat.save()
+    await chat.asave(update_fields=['is_shared'])
     return {"uid": chat.uid, "is_shared": chat.is_shared}
 
 
 @router.get("/{uid}/shared", response=ChatDetailSchema, auth=None)
-def get_shared_chat(request, uid: str):
+async def get_shared_chat(
+    request, uid: str, limit: int | None = None, before: int | None = None, summary: bool = False
+):
     """Get shared chat details without authentication."""
-    chat = get_object_or_404(Chat, uid=uid, is_shared=True)
-    return chat
+    return await get_prompt_window(limit=limit, before=before, summary=summary, uid=uid, is_shared=True)
 
 
 @router.get("/{uid}/stream", auth=query_token_auth)
@@ -138,6 +216,9 @@ async def chat_stream(request, uid: str):
     # Ensure chat belongs to authenticated user (auth is automatic via QueryTokenAuth)
     await aget_object_or_404(Chat, uid=uid, user=request.auth)
 
+    # Browsers send Last-Event-ID on automatic reconnect, the query param is for manual reconnects
+    last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+
     async def event_stream():
         """Async generator for SSE events."""
         try:
@@ -145,10 +226,13 @@ async def chat_stream(request, uid: str):
             yield f"data: {json.dumps({'type': 'connected', 'chat_uid': uid})}\n\n"
 
             # Subscribe to Redis channel and yield events
-            async for message in pubsub.subscribe_to_chat(uid):
+            async for event_id, message in pubsub.subscribe_to_chat(uid, last_event_id):
                 # Format as SSE event
                 event_data = json.dumps(message)
-                yield f"data: {event_data}\n\n"
+                if event_id:
+                    yield f"id: {event_id}\ndata: {event_data}\n\n"
+                else:
+                    yield f"data: {event_data}\n\n"
 
         except asyncio.CancelledError:
             # Client disconnected
@@ -175,12 +259,89 @@ class FileUploadResponse(Schema):
 
 
 @router.post("/files/upload", response=FileUploadResponse)
-def upload_file(request, file: UploadedFile):
-    """Upload a file and return its ID."""
-    # Get media type from content_type
-    media_type = file.content_type or 'application/octet-stream'
+async def upload_file(request, file: UploadedFile):
+    """Upload a file and return its ID (media type is sniffed from the content)."""
+    file_obj = await store_upload(request.auth, file)
+    return {"id": file_obj.id, "filename": file_obj.filename}
+
+
+@router.api_operation(["GET", "HEAD"], "/files/{file_id}/content")
+async def file_content(request, file_id: int):
+    """Download/preview an uploaded file (supports Range and conditional requests)."""
+    file = await aget_object_or_404(File, id=file_id, user=request.auth)
+    return await serve_file(request, file)
+
+
+class FileUrlSchema(Schema):
+    url: str
+
+
+@router.post("/files/{file_id}/url", response=FileUrlSchema)
+async def file_url(request, file_id: int):
+    """Short-lived signed link to an uploaded file, for links/src where the Authorization header can't be set."""
+    file = await aget_object_or_404(File, id=file_id, user=request.auth)
+    return {"url": reverse('api-1.0.0:signed_file_content', kwargs={'signature': sign_file_id(file.id)})}
+
+
+@router.api_operation(["GET", "HEAD"], "/files/signed/{signature}", auth=None, url_name='signed_file_content')
+async def signed_file_content(request, signature: str):
+    """Uploaded file of a signed link (see file_url)."""
+    file_id = unsign_file_id(signature)
+    if file_id is None:
+        raise HttpError(403, "Link is invalid or expired")
+    file = await aget_object_or_404(File, id=file_id)
+    return await serve_file(request, file)
+
+
+class StartUploadSchema(Schema):
+    filename: str
+    size: int
+    media_type: str = ""
+
+
+class UploadSchema(ModelSchema):
+    chunk_size: int
+
+    class Meta:
+        model = Upload
+        fields = ['uid', 'filename', 'size', 'received']
+
+    @staticmethod
+    def resolve_chunk_size(obj):
+        return settings.UPLOAD_CHUNK_MAX_SIZE
+
+
+@router.post("/files/uploads", response=UploadSchema)
+async def create_upload(request, data: StartUploadSchema):
+    """Start a resumable upload - then PUT chunks and complete it."""
+    return await start_upload(request.auth, data.filename, data.size, data.media_type)
+
+
+@router.get("/files/uploads/{uid}", response=UploadSchema)
+async def get_upload(request, uid: str):
+    """Upload progress - `received` is the offset to resume from."""
+    return await aget_object_or_404(Upload, uid=uid, user=request.auth)
+
+
+@router.put("/files/uploads/{uid}", response=UploadSchema)
+async def upload_chunk(request, uid: str, offset: int):
+    """Write the raw request body at `offset` (must equal `received`)."""
+    upload = await aget_object_or_404(Upload, uid=uid, user=request.auth)
+    return await receive_chunk(upload, request, offset)
+
+
+@router.post("/files/uploads/{uid}/complete", response=FileUploadResponse)
+async def finish_upload(request, uid: str):
+    """Store the uploaded file and return its ID."""
+    upload = await aget_object_or_404(Upload, uid=uid, user=request.auth)
+    file_obj = await complete_upload(request.auth, upload)
+    return {"id": file_obj.id, "filename": file_obj.filename}
 
-    # Create File object
-    file_obj = File.objects.create(user=request.auth, file=file, media_type=media_type)
 
-    return {"id": file_obj.id, "filename": file.name}
+@router.delete("/files/uploads/{uid}")
+async def cancel_upload(request, uid: str):
+    """Abort a resumable upload."""
+    upload = await aget_object_or_404(Upload, uid=uid, user=request.auth)
+    delete_part(upload)
+    await upload.adelete()
+    return {"success": True}
@@ -8,6 +8,11 @@ class ChatConfig(AppConfig):
     name = 'chat'
 
     def ready(self):
+        from django.db.models.signals import post_delete
+        from chat.blobs import file_deleted
+
+        post_delete.connect(file_deleted, sender='chat.File')
+
         # Simple signal handler that exits immediately
         def signal_handler(signum, frame):
             print(f"\nReceived signal {signum}, exiting immediately...")
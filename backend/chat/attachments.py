@@ -0,0 +1,82 @@
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from pydantic_ai import BinaryContent
+from chat.models import File
+
+
+class AttachmentCache:
+    """LRU of attachment contents keyed by File.id, bounded by total size in bytes.
+
+    Uploaded files are never modified, so entries don't need invalidation besides eviction.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[int, BinaryContent] = OrderedDict()
+
+    def get(self, file_id: int) -> BinaryContent | None:
+        content = self._entries.get(file_id)
+        if content is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(file_id)
+        self.hits += 1
+        return content
+
+    def put(self, file_id: int, content: BinaryContent):
+        self.discard(file_id)
+        size = len(content.data)
+        if size > self.max_bytes // 4:
+            return  # one huge file should not flush the whole cache
+        self._entries[file_id] = content
+        self.size += size
+        while self.size > self.max_bytes:
+            _file_id, evicted = self._entries.popitem(last=False)
+            self.size -= len(evicted.data)
+
+    def discard(self, file_id: int):
+        content = self._entries.pop(file_id, None)
+        if content is not None:
+            self.size -= len(content.data)
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+
+    def stats(self) -> dict:
+        return {'entries': len(self._entries), 'size': self.size, 'hits': self.hits, 'misses': self.misses}
+
+
+attachment_cache = AttachmentCache(settings.ATTACHMENT_CACHE_MAX_BYTES)
+
+# Disk reads happen here so big files don't block the worker's event loop
+_read_executor = ThreadPoolExecutor(max_workers=settings.ATTACHMENT_READ_THREADS, thread_name_prefix='attachments')
+_reading: dict[int, asyncio.Future] = {}
+
+
+def read_file(file: File) -> bytes:
+    with file.file.open('rb') as f:
+        return f.read()
+
+
+async def load_attachment(file: File) -> BinaryContent:
+    """File content for the LLM - from the cache or read in a thread (concurrent loads share one read)."""
+    content = attachment_cache.get(file.id)
+    if content is not None:
+        return content
+
+    future = _reading.get(file.id)
+    if future is None:
+        future = asyncio.get_running_loop().run_in_executor(_read_executor, read_file, file)
+        _reading[file.id] = future
+        future.add_done_callback(lambda _future: _reading.pop(file.id, None))
+    data = await asyncio.shield(future)  # a cancelled prompt must not cancel the read for the others
+
+    content = BinaryContent(data=data, media_type=file.media_type)
+    attachment_cache.put(file.id, content)
+    return content
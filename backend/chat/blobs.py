@@ -0,0 +1,75 @@
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F
+from chat.models import Blob, File, blob_path
+
+STORE_ATTEMPTS = 3
+
+
+def store_blob_content(name: str, content):
+    """Write the content-addressed file unless it's already stored.
+
+    Called outside of transactions - copying a large upload there would hold the database write lock
+    (SQLite) or the blob row lock for as long.
+    """
+    if default_storage.exists(name):
+        return
+    if content is None:
+        raise ValueError(f"Blob {name} is not stored and no content was given")
+    # Temporary uploads are moved into place by the file system storage, not copied
+    stored = default_storage.save(name, content)
+    if stored != name:  # a concurrent upload of the same content was faster
+        default_storage.delete(stored)
+
+
+def acquire_blob(sha256: str, size: int, content=None) -> Blob:
+    """Add a reference to the blob with this hash, storing `content` if it's not stored yet."""
+    name = blob_path(sha256)
+    for _attempt in range(STORE_ATTEMPTS):
+        store_blob_content(name, content)
+        with transaction.atomic():
+            blob, _created = Blob.objects.select_for_update().get_or_create(
+                sha256=sha256, defaults={'size': size, 'file': name}
+            )
+            # Checked under the row lock, which delete_unreferenced_blob holds while deleting the content
+            if default_storage.exists(name):
+                Blob.objects.filter(pk=blob.pk).update(refcount=F('refcount') + 1)
+                return blob
+        # The last reference was released and the content deleted in between - store it again
+    raise RuntimeError(f"Blob {sha256} was deleted while storing it {STORE_ATTEMPTS} times")
+
+
+def release_blob(sha256: str):
+    """Drop a reference to the blob, deleting the stored content with the last one."""
+    with transaction.atomic():
+        blob = Blob.objects.select_for_update().filter(sha256=sha256).first()
+        if blob is None:
+            return
+        if blob.refcount:
+            Blob.objects.filter(pk=blob.pk).update(refcount=F('refcount') - 1)
+        if blob.refcount <= 1:
+            transaction.on_commit(lambda: delete_unreferenced_blob(sha256))
+
+
+def delete_unreferenced_blob(sha256: str):
+    """Delete the content and row of a blob without references, unless acquire_blob added one meanwhile."""
+    with transaction.atomic():
+        blob = Blob.objects.select_for_update().filter(sha256=sha256, refcount=0).first()
+        if blob is None:
+            return
+        default_storage.delete(blob.file.name)
+        blob.delete()
+
+
+def create_file(user, content, name: str, media_type: str, sha256: str, size: int) -> File:
+    """Store content deduplicated by its hash - a repeated upload only costs hashing and a DB row."""
+    blob = acquire_blob(sha256, size, content)
+    return File.objects.create(
+        user=user, file=blob.file.name, name=name, media_type=media_type, sha256=sha256, size=size
+    )
+
+
+def file_deleted(sender, instance: File, **kwargs):
+    """post_delete handler of File - releases the blob of deduplicated uploads."""
+    if instance.sha256:
+        release_blob(instance.sha256)
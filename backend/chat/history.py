@@ -0,0 +1,236 @@
+import json
+import traceback
+from collections import OrderedDict
+from django.conf import settings
+from pydantic_ai import Agent
+from pydantic_ai.messages import (
+    BinaryContent,
+    ModelMessage,
+    ModelMessagesTypeAdapter,
+    ModelRequest,
+    ModelResponse,
+    SystemPromptPart,
+    TextPart,
+    ToolCallPart,
+    ToolReturnPart,
+    UserPromptPart,
+)
+from chat.models import ChatSummary, Prompt
+
+
+class HistoryCache:
+    """LRU of validated conversation history, one entry per chat, bounded by approximate size in bytes.
+
+    Entries are keyed by chat id and the id of the last prompt included in the history, so a new
+    prompt in the chat (or a finished run) never serves stale messages.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[int, tuple[int, list[ModelMessage], int]] = OrderedDict()
+
+    def get(self, chat_id: int, last_prompt_id: int) -> list[ModelMessage] | None:
+        entry = self._entries.get(chat_id)
+        if entry is None or entry[0] != last_prompt_id:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(chat_id)
+        self.hits += 1
+        return list(entry[1])
+
+    def put(self, chat_id: int, last_prompt_id: int, messages: list[ModelMessage]):
+        self.discard(chat_id)
+        size = estimate_size(messages)
+        if size > self.max_bytes:
+            return
+        self._entries[chat_id] = (last_prompt_id, list(messages), size)
+        self.size += size
+        while self.size > self.max_bytes:
+            _chat_id, (_prompt_id, _messages, evicted_size) = self._entries.popitem(last=False)
+            self.size -= evicted_size
+
+    def discard(self, chat_id: int):
+        entry = self._entries.pop(chat_id, None)
+        if entry is not None:
+            self.size -= entry[2]
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+
+    def stats(self) -> dict:
+        return {'entries': len(self._entries), 'size': self.size, 'hits': self.hits, 'misses': self.misses}
+
+
+def estimate_size(messages: list[ModelMessage]) -> int:
+    """Rough memory footprint of messages - text and binary content dominate."""
+    size = 0
+    for message in messages:
+        for part in message.parts:
+            size += 100
+            content = getattr(part, 'content', None)
+            if isinstance(content, str):
+                size += len(content)
+            elif isinstance(content, list):
+                for item in content:
+                    if isinstance(item, BinaryContent):
+                        size += len(item.data)
+                    elif isinstance(item, str):
+                        size += len(item)
+    return size
+
+
+history_cache = HistoryCache(settings.HISTORY_CACHE_MAX_BYTES)
+
+
+async def load_history(chat_id: int, before_prompt_id: int) -> list[ModelMessage] | None:
+    """Rebuild conversation history from the per-prompt message deltas (Prompt.llm_messages)."""
+    prompts = Prompt.objects.filter(chat_id=chat_id, id__lt=before_prompt_id).order_by('id')
+    last_prompt = await prompts.order_by('-id').values_list('id', 'status').afirst()
+    if last_prompt is None:
+        return None
+    last_prompt_id, last_status = last_prompt
+
+    history = history_cache.get(chat_id, last_prompt_id)
+    if history is None:
+        messages = []
+        async for llm_messages in prompts.values_list('llm_messages', flat=True):
+            messages.extend(llm_messages)
+        history = ModelMessagesTypeAdapter.validate_python(messages)
+        # A prompt still running has no messages yet - caching now would drop them for good
+        if last_status == 'finished':
+            history_cache.put(chat_id, last_prompt_id, history)
+    return history or None
+
+
+# History compaction ---------------------------------------------------------------------------------------------
+
+ATTACHMENT_TOKENS = 1500  # rough cost of an image/document, real cost depends on provider and size
+
+SUMMARY_INSTRUCTIONS = (
+    'Summarize the conversation below so it can replace it as context for continuing the conversation. '
+    'Keep facts, decisions, names, numbers, code identifiers and open questions. '
+    'Write at most 400 words, no preamble.'
+)
+
+summary_agent = Agent(output_type=str, system_prompt=SUMMARY_INSTRUCTIONS)
+
+
+def estimate_tokens(messages: list[ModelMessage]) -> int:
+    """Cheap token estimate (~4 characters per token)."""
+    chars = 0
+    attachments = 0
+    for message in messages:
+        for part in message.parts:
+            if isinstance(part, ToolCallPart):
+                chars += len(part.tool_name) + len(part.args_as_json_str())
+                continue
+            content = getattr(part, 'content', None)
+            if isinstance(content, str):
+                chars += len(content)
+            elif isinstance(content, list):
+                for item in content:
+                    if isinstance(item, str):
+                        chars += len(item)
+                    else:
+                        attachments += 1
+            elif content is not None:
+                chars += len(json.dumps(content, default=str))
+    return chars // 4 + attachments * ATTACHMENT_TOKENS
+
+
+def split_turns(messages: list[ModelMessage]) -> list[list[ModelMessage]]:
+    """Split history into turns - each starts with a request carrying the user prompt."""
+    turns = []
+    for message in messages:
+        starts_turn = isinstance(message, ModelRequest) and any(isinstance(p, UserPromptPart) for p in message.parts)
+        if starts_turn or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+def render_turns(turns: list[list[ModelMessage]]) -> str:
+    """Plain text transcript of turns for the summarizer."""
+    lines = []
+    for turn in turns:
+        for message in turn:
+            for part in message.parts:
+                if isinstance(part, UserPromptPart):
+                    content = (
+                        part.content
+                        if isinstance(part.content, str)
+                        else ' '.join(item if isinstance(item, str) else '[attachment]' for item in part.content)
+                    )
+                    lines.append(f'User: {content}')
+                elif isinstance(part, TextPart):
+                    lines.append(f'Assistant: {part.content}')
+                elif isinstance(part, ToolCallPart):
+                    lines.append(f'Assistant called tool {part.tool_name}({part.args_as_json_str()})')
+                elif isinstance(part, ToolReturnPart):
+                    lines.append(f'Tool {part.tool_name} returned: {part.model_response_str()[:1000]}')
+    return '\n'.join(lines)
+
+
+def summary_messages(system_parts: list[SystemPromptPart], summary: str) -> list[ModelMessage]:
+    return [
+        ModelRequest(parts=[*system_parts, UserPromptPart(f'Summary of our conversation so far:\n\n{summary}')]),
+        ModelResponse(parts=[TextPart('Got it, I will continue from this summary.')]),
+    ]
+
+
+async def compact_history(chat_id: int, history: list[ModelMessage] | None, model) -> list[ModelMessage] | None:
+    """Fit history into HISTORY_MAX_TOKENS by replacing older turns with a summary.
+
+    The most recent turns (up to HISTORY_KEEP_TURNS, within half of the budget) are kept as is.
+    Summaries are stored in ChatSummary and reused until the history outgrows them again, then
+    extended incrementally (previous summary + newly dropped turns).
+    """
+    max_tokens = settings.HISTORY_MAX_TOKENS
+    if not history or not max_tokens or estimate_tokens(history) <= max_tokens:
+        return history
+
+    turns = split_turns(history)
+    # System prompt only lives in the first request - it has to survive the compaction
+    system_parts = [p for p in turns[0][0].parts if isinstance(p, SystemPromptPart)]
+    flatten = lambda turns: [message for turn in turns for message in turn]  # noqa: E731
+
+    summary = await ChatSummary.objects.filter(chat_id=chat_id, turns__lt=len(turns)).order_by('-turns').afirst()
+    if summary:
+        compacted = summary_messages(system_parts, summary.text) + flatten(turns[summary.turns :])
+        if estimate_tokens(compacted) <= max_tokens:
+            return compacted
+
+    # Recent window kept verbatim
+    keep = 0
+    window_tokens = 0
+    for turn in reversed(turns[1:]):
+        turn_tokens = estimate_tokens(turn)
+        if keep >= settings.HISTORY_KEEP_TURNS or window_tokens + turn_tokens > max_tokens // 2:
+            break
+        keep += 1
+        window_tokens += turn_tokens
+    keep = max(keep, 1)
+    cut = len(turns) - keep
+
+    covered = summary.turns if summary else 0
+    if cut <= covered:
+        # Window itself is too big, nothing more to summarize - send it and let the provider decide
+        return compacted if summary else history
+
+    transcript = render_turns(turns[covered:cut])
+    if summary:
+        transcript = f'Summary of the earlier conversation:\n{summary.text}\n\nContinuation:\n{transcript}'
+    try:
+        result = await summary_agent.run(transcript, model=model)
+        text = result.output
+    except Exception:
+        # Better to lose the old context than to fail the prompt on context length
+        print(f'Error summarizing chat {chat_id} history:\n{traceback.format_exc()}')
+        return [ModelRequest(parts=system_parts)] + flatten(turns[cut:]) if system_parts else flatten(turns[cut:])
+
+    await ChatSummary.objects.aupdate_or_create(chat_id=chat_id, turns=cut, defaults={'text': text})
+    return summary_messages(system_parts, text) + flatten(turns[cut:])
@@ -0,0 +1,107 @@
+import time
+import asyncio
+import httpx
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+from django.shortcuts import get_object_or_404
+from django.test import override_settings
+from django.urls import include, path
+from ninja import NinjaAPI
+from auth.auth import create_jwt_token, jwt_bearer_auth
+from chat.api import ChatDetailSchema, ChatListSchema, chat_detail_queryset
+from chat.models import Chat, Prompt
+
+# Sync versions of the chat endpoints (how they were served before the views became async)
+sync_api = NinjaAPI(auth=jwt_bearer_auth, urls_namespace='bench_sync')
+
+
+@sync_api.get("/chats", response=list[ChatListSchema])
+def sync_list_chats(request, limit: int = 50):
+    chats = Chat.objects.filter(user=request.auth).order_by('-timestamp', '-id')
+    result = list(chats.values('id', 'uid', 'headline', 'timestamp')[:limit])
+    for chat in result:
+        chat['cursor'] = f"{chat['timestamp'].isoformat()}_{chat['id']}"
+    return result
+
+
+@sync_api.get("/chats/{uid}", response=ChatDetailSchema)
+def sync_get_chat(request, uid: str, limit: int = 30):
+    chat = get_object_or_404(chat_detail_queryset(limit), uid=uid, user=request.auth)
+    chat.has_more = len(chat.prompt_window) > limit
+    chat.prompt_window = chat.prompt_window[:limit][::-1]
+    return chat
+
+
+urlpatterns = [
+    path('', include('urls')),
+    path('sync/', sync_api.urls),
+]
+
+
+class Command(BaseCommand):
+    help = 'Compare requests/sec and latency of the async API views with their sync versions (in-process ASGI)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=50)
+
+    def handle(self, *args, **options):
+        user, _ = User.objects.get_or_create(username='bench_api@example.com')
+        chat = Chat.objects.create(headline='bench_api', model='dummy:dummy', user=user)
+        Prompt.objects.bulk_create(
+            [
+                Prompt(chat=chat, input_text=f'Question {i}', output_text='Answer ' * 50, status='finished')
+                for i in range(50)
+            ]
+        )
+        token = create_jwt_token(user.id)
+        try:
+            with override_settings(ROOT_URLCONF=__name__):
+                for name, url in [
+                    ('chat list', 'chats'),
+                    ('chat detail', f'chats/{chat.uid}?limit=30'),
+                ]:
+                    for variant in ('sync', 'api'):
+                        stats = asyncio.run(self.run_load(f'/{variant}/{url}', token, **options))
+                        label = 'async' if variant == 'api' else 'sync'
+                        self.stdout.write(
+                            f'{name:>12} {label:>5}: {stats["rps"]:7.0f} req/s, '
+                            f'p50 {stats["p50"]:6.1f} ms, p99 {stats["p99"]:6.1f} ms, {stats["errors"]} errors'
+                        )
+        finally:
+            chat.delete()
+            user.delete()
+
+    async def run_load(self, url, token, requests, concurrency, **_options):
+        application = get_asgi_application()
+        transport = httpx.ASGITransport(app=application)
+        headers = {'Authorization': f'Bearer {token}'}
+        latencies = []
+        errors = 0
+        remaining = requests
+
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench', headers=headers) as client:
+            await client.get(url)  # warm up
+
+            async def user_loop():
+                nonlocal remaining, errors
+                while remaining > 0:
+                    remaining -= 1
+                    start = time.perf_counter()
+                    response = await client.get(url)
+                    latencies.append(time.perf_counter() - start)
+                    if response.status_code != 200:
+                        errors += 1
+
+            start = time.perf_counter()
+            await asyncio.gather(*(user_loop() for _ in range(concurrency)))
+            elapsed = time.perf_counter() - start
+
+        latencies.sort()
+        return {
+            'rps': len(latencies) / elapsed,
+            'p50': latencies[len(latencies) // 2] * 1000,
+            'p99': latencies[int(len(latencies) * 0.99) - 1] * 1000,
+            'errors': errors,
+        }
@@ -0,0 +1,123 @@
+import time
+import asyncio
+import multiprocessing
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.contrib.auth.models import User
+from django.db import OperationalError, connection, connections
+from django.utils import timezone
+from asgiref.sync import sync_to_async
+from chat.models import Chat, Prompt
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    return values[min(int(len(values) * fraction), len(values) - 1)] * 1000 if values else 0.0
+
+
+async def stream_prompt(prompt_id: int, flushes: int, chunk: str, interval: float, results: dict):
+    """Persist a growing output_text like the LLM worker does while streaming."""
+    prompt = await Prompt.objects.aget(id=prompt_id)
+    prompt.output_text = ''
+    for _ in range(flushes):
+        prompt.output_text += chunk
+        prompt.modified = timezone.now()
+        start = time.perf_counter()
+        try:
+            await prompt.asave(update_fields=['output_text', 'modified'])
+            results['writes'].append(time.perf_counter() - start)
+        except OperationalError:
+            results['errors'] += 1
+        await asyncio.sleep(interval)
+
+
+async def read_chats(user_id: int, stop: asyncio.Event, results: dict):
+    """Load the chat list and latest prompts like the web process does while streams are running."""
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            async for _ in Chat.objects.filter(user_id=user_id).order_by('-timestamp')[:20]:
+                pass
+            async for _ in Prompt.objects.filter(chat__user_id=user_id).order_by('-id')[:30]:
+                pass
+            results['reads'].append(time.perf_counter() - start)
+        except OperationalError:
+            results['errors'] += 1
+        await asyncio.sleep(0)
+
+
+def run_process(prompt_ids: list[int], user_id: int, flushes: int, chunk: str, interval: float, readers: int) -> dict:
+    """One process (a web process or worker) running streams and readers concurrently."""
+    results = {'writes': [], 'reads': [], 'errors': 0}
+
+    async def main():
+        stop = asyncio.Event()
+        reader_tasks = [asyncio.create_task(read_chats(user_id, stop, results)) for _ in range(readers)]
+        await asyncio.gather(*(stream_prompt(prompt_id, flushes, chunk, interval, results) for prompt_id in prompt_ids))
+        stop.set()
+        await asyncio.gather(*reader_tasks)
+        await sync_to_async(connections.close_all)()
+
+    asyncio.run(main())
+    return results
+
+
+class Command(BaseCommand):
+    help = (
+        'Concurrent streaming throughput of the configured database: processes write growing prompt outputs '
+        '(like LLM workers) while readers load chats (like web processes). Run once per DB_ENGINE / SQLITE_WAL setting.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=4)
+        parser.add_argument('--streams', type=int, default=10, help='streams per process')
+        parser.add_argument('--flushes', type=int, default=50, help='writes per stream')
+        parser.add_argument('--chunk-size', type=int, default=200, help='characters added per write')
+        parser.add_argument('--interval', type=float, default=0.0, help='seconds between writes of a stream')
+        parser.add_argument('--readers', type=int, default=2, help='concurrent readers per process')
+
+    def handle(self, *args, **options):
+        database = settings.DATABASES['default']
+        pragmas = database.get('OPTIONS', {}).get('init_command') or database.get('OPTIONS', {}).get('pool') or ''
+        self.stdout.write(f'{connection.vendor}: {database["NAME"]} {pragmas}')
+
+        user, _ = User.objects.get_or_create(username='bench_db@example.com')
+        processes = options['processes']
+        streams = options['streams']
+        prompt_ids = []
+        for _ in range(processes * streams):
+            chat = Chat.objects.create(headline='bench_db', model='dummy:dummy', user=user)
+            prompt_ids.append(Prompt.objects.create(chat=chat, input_text='Question', status='running').id)
+
+        try:
+            connections.close_all()  # children open their own connections
+            jobs = [
+                (
+                    prompt_ids[i * streams : (i + 1) * streams],
+                    user.id,
+                    options['flushes'],
+                    'x' * options['chunk_size'],
+                    options['interval'],
+                    options['readers'],
+                )
+                for i in range(processes)
+            ]
+            start = time.perf_counter()
+            pool = multiprocessing.get_context('fork').Pool(processes)
+            results = pool.starmap(run_process, jobs)
+            pool.close()
+            pool.join()
+            elapsed = time.perf_counter() - start
+        finally:
+            Chat.objects.filter(user=user).delete()
+            user.delete()
+
+        writes = sorted(latency for result in results for latency in result['writes'])
+        reads = sorted(latency for result in results for latency in result['reads'])
+        errors = sum(result['errors'] for result in results)
+        self.stdout.write(
+            f'writes: {len(writes) / elapsed:8.0f}/s, p50 {percentile(writes, 0.5):7.2f} ms, p99 {percentile(writes, 0.99):7.2f} ms'
+        )
+        self.stdout.write(
+            f'reads:  {len(reads) / elapsed:8.0f}/s, p50 {percentile(reads, 0.5):7.2f} ms, p99 {percentile(reads, 0.99):7.2f} ms'
+        )
+        self.stdout.write(f'{errors} errors ("database is locked"), {elapsed:.1f}s')
@@ -0,0 +1,70 @@
+import time
+import asyncio
+from django.core.management.base import BaseCommand
+from django.db.models import Sum
+from django.db.models.functions import Length
+from django.utils.lorem_ipsum import paragraphs
+from pydantic_ai.messages import ModelMessagesTypeAdapter, ModelRequest, ModelResponse, TextPart, UserPromptPart
+from chat.history import history_cache, load_history
+from chat.models import Chat, Prompt
+
+
+class Command(BaseCommand):
+    help = 'Compare storage and load time of full vs incremental Prompt.llm_messages for a long chat'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--turns', type=int, default=500)
+
+    def handle(self, *args, **options):
+        turns = options['turns']
+        answer = '\n'.join(paragraphs(3))
+        deltas = []
+        for i in range(turns):
+            messages = [
+                ModelRequest(parts=[UserPromptPart(content=f'Question number {i}?')]),
+                ModelResponse(parts=[TextPart(content=answer)]),
+            ]
+            deltas.append(ModelMessagesTypeAdapter.dump_python(messages, mode='json'))
+
+        full_chat = Chat.objects.create(headline='bench_history full', model='dummy:dummy')
+        delta_chat = Chat.objects.create(headline='bench_history incremental', model='dummy:dummy')
+        try:
+            # Old format: every prompt stores the whole conversation so far
+            history = []
+            full_prompts = []
+            for delta in deltas:
+                history = history + delta
+                full_prompts.append(Prompt(chat=full_chat, input_text='', llm_messages=history))
+            Prompt.objects.bulk_create(full_prompts, batch_size=50)
+            Prompt.objects.bulk_create(
+                [Prompt(chat=delta_chat, input_text='', llm_messages=delta) for delta in deltas], batch_size=50
+            )
+            last_full = Prompt.objects.create(chat=full_chat, input_text='next')
+            last_delta = Prompt.objects.create(chat=delta_chat, input_text='next')
+
+            self.report('full', full_chat, lambda: self.load_full(full_chat.id, last_full.id))
+            self.report('incremental', delta_chat, lambda: self.load_incremental(delta_chat.id, last_delta.id))
+            self.report('cached', delta_chat, lambda: asyncio.run(load_history(delta_chat.id, last_delta.id)))
+        finally:
+            full_chat.delete()
+            delta_chat.delete()
+
+    def load_full(self, chat_id, prompt_id):
+        prev_prompt = Prompt.objects.filter(chat_id=chat_id).exclude(id=prompt_id).order_by('-created').first()
+        return ModelMessagesTypeAdapter.validate_python(prev_prompt.llm_messages)
+
+    def load_incremental(self, chat_id, prompt_id):
+        history_cache.clear()
+        return asyncio.run(load_history(chat_id, prompt_id))
+
+    def report(self, name, chat, load):
+        size = Prompt.objects.filter(chat=chat).aggregate(size=Sum(Length('llm_messages')))['size']
+        timings = []
+        for _ in range(5):
+            start = time.perf_counter()
+            messages = load()
+            timings.append(time.perf_counter() - start)
+        self.stdout.write(
+            f'{name:>12}: stored {size / 1024 / 1024:8.2f} MB, '
+            f'history load {min(timings) * 1000:7.1f} ms (best of 5), {len(messages)} messages'
+        )
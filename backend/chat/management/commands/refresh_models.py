@@ -0,0 +1,15 @@
+import asyncio
+from django.core.management.base import BaseCommand
+from llms.catalog import model_catalog
+from llms.providers import fetch_openrouter_models
+from utils.cache import clear_cache
+
+
+class Command(BaseCommand):
+    help = 'Fetch model lists from the LLM providers and store the snapshot served by GET /models'
+
+    def handle(self, *args, **options):
+        clear_cache(fetch_openrouter_models)  # fetch now, even if another process just did
+        asyncio.run(model_catalog.refresh())
+        stats = model_catalog.stats()
+        self.stdout.write(self.style.SUCCESS(f'Stored {stats["models"]} models of {stats["providers"]} providers'))
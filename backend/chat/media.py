@@ -0,0 +1,130 @@
+import os
+import re
+import asyncio
+from django.conf import settings
+from django.core import signing
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe
+from chat.models import File
+
+CHUNK_SIZE = 64 * 1024
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+FILE_URL_SALT = 'chat.media.file_url'
+# Shown in the browser, anything else (html, svg, scripts...) is downloaded so it can't run on our origin
+INLINE_MEDIA_TYPES = ('image/png', 'image/jpeg', 'image/gif', 'image/webp', 'image/avif', 'application/pdf')
+
+
+def sign_file_id(file_id: int) -> str:
+    """Signature of a file link, valid for FILE_URL_MAX_AGE seconds (see unsign_file_id)."""
+    return signing.dumps(file_id, salt=FILE_URL_SALT)
+
+
+def unsign_file_id(signature: str) -> int | None:
+    """File id of a valid, unexpired link signature."""
+    try:
+        return signing.loads(signature, salt=FILE_URL_SALT, max_age=settings.FILE_URL_MAX_AGE)
+    except signing.BadSignature:
+        return None
+
+
+def parse_range(header: str, size: int) -> tuple[int, int] | None:
+    """(start, end) inclusive of a single byte range, None to serve the whole file.
+
+    Raises ValueError for unsatisfiable ranges. Multiple ranges are answered with the whole file.
+    """
+    match = RANGE_RE.match(header.replace(' ', ''))
+    if not match:
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:  # suffix range - last N bytes
+        length = int(end)
+        if length == 0:
+            raise ValueError("Empty suffix range")
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise ValueError("Range not satisfiable")
+    return start, end
+
+
+async def read_range(path: str, start: int, end: int):
+    """File bytes start..end in chunks, disk reads off the event loop."""
+    f = await asyncio.to_thread(open, path, 'rb')
+    try:
+        await asyncio.to_thread(f.seek, start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = await asyncio.to_thread(f.read, min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+async def serve_file(request, file: File) -> HttpResponse:
+    """Stream an uploaded file with Range and conditional GET support.
+
+    With MEDIA_OFFLOAD set the response only carries X-Accel-Redirect/X-Sendfile and the
+    web server sends the content (ranges included).
+    """
+    path = file.file.path
+    stat = await asyncio.to_thread(os.stat, path)
+    size = stat.st_size
+    # Content never changes for a file id - deduplicated uploads even have the hash as ETag
+    etag = f'"{file.sha256}"' if file.sha256 else f'"{int(stat.st_mtime):x}-{size:x}"'
+    last_modified = int(stat.st_mtime)
+    inline = file.media_type in INLINE_MEDIA_TYPES
+
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(last_modified),
+        'Cache-Control': 'private, max-age=31536000, immutable',
+        'Content-Type': file.media_type,
+        'Content-Disposition': content_disposition_header(not inline, file.filename),
+        'X-Content-Type-Options': 'nosniff',
+        'Accept-Ranges': 'bytes',
+    }
+    if not inline:
+        headers['Content-Security-Policy'] = 'sandbox'
+
+    conditional = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if conditional is not None:
+        for header in ('ETag', 'Last-Modified', 'Cache-Control'):
+            conditional[header] = headers[header]
+        return conditional
+
+    if settings.MEDIA_OFFLOAD == 'x-accel-redirect':
+        response = HttpResponse(headers=headers)
+        response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_REDIRECT_PREFIX + file.file.name
+        return response
+    if settings.MEDIA_OFFLOAD == 'x-sendfile':
+        response = HttpResponse(headers=headers)
+        response['X-Sendfile'] = path
+        return response
+
+    byte_range = None
+    range_header = request.headers.get('Range')
+    if_range = request.headers.get('If-Range')
+    # If-Range: only honor the range when the client's copy is still current
+    if range_header and (not if_range or if_range == etag or parse_http_date_safe(if_range) == last_modified):
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            return HttpResponse(status=416, headers={'Content-Range': f'bytes */{size}'})
+
+    if byte_range is None:
+        start, end, status = 0, size - 1, 200
+    else:
+        (start, end), status = byte_range, 206
+        headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+    headers['Content-Length'] = str(end - start + 1)
+
+    if request.method == 'HEAD' or size == 0:
+        return HttpResponse(status=status, headers=headers)
+    return StreamingHttpResponse(read_range(path, start, end), status=status, headers=headers)
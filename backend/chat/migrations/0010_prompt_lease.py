@@ -0,0 +1,23 @@
+# Generated by Django 5.2.3 on 2026-10-18 11:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0009_file_prompt_files'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='prompt',
+            name='lease_expires',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='prompt',
+            name='worker_id',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+    ]
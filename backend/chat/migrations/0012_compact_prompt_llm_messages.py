@@ -0,0 +1,46 @@
+# Prompt.llm_messages used to hold the whole conversation up to the prompt,
+# now it only keeps the messages added by the prompt itself.
+
+from django.db import migrations
+
+
+def compact_llm_messages(apps, schema_editor):
+    Chat = apps.get_model('chat', 'Chat')
+    Prompt = apps.get_model('chat', 'Prompt')
+
+    for chat_id in Chat.objects.values_list('id', flat=True).iterator():
+        previous = []
+        for prompt in Prompt.objects.filter(chat_id=chat_id).only('id', 'llm_messages').order_by('id'):
+            messages = prompt.llm_messages
+            if not messages:
+                continue  # failed/unfinished prompt
+            if messages[: len(previous)] == previous:
+                prompt.llm_messages = messages[len(previous) :]
+                prompt.save(update_fields=['llm_messages'])
+            # otherwise history was not continued (e.g. after a failed prompt) - keep as is
+            previous = messages
+
+
+def expand_llm_messages(apps, schema_editor):
+    Chat = apps.get_model('chat', 'Chat')
+    Prompt = apps.get_model('chat', 'Prompt')
+
+    for chat_id in Chat.objects.values_list('id', flat=True).iterator():
+        history = []
+        for prompt in Prompt.objects.filter(chat_id=chat_id).only('id', 'llm_messages').order_by('id'):
+            if not prompt.llm_messages:
+                continue
+            history = history + prompt.llm_messages
+            prompt.llm_messages = history
+            prompt.save(update_fields=['llm_messages'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0011_chat_user_timestamp_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(compact_llm_messages, expand_llm_messages),
+    ]
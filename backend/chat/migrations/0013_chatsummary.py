@@ -0,0 +1,28 @@
+# Generated by Django 5.2.3 on 2026-10-18 12:04
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0012_compact_prompt_llm_messages'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('turns', models.PositiveIntegerField()),
+                ('text', models.TextField()),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('chat', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='summaries', to='chat.chat')),
+            ],
+            options={
+                'unique_together': {('chat', 'turns')},
+            },
+        ),
+    ]
@@ -22,6 +22,10 @@ class Chat(models.Model):
 
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            # chat list (sidebar) keyset pagination: WHERE user_id = ? ORDER BY timestamp DESC, id DESC
+            models.Index(fields=['user', 'timestamp'], name='chat_user_timestamp_idx'),
+        ]
 
     def __str__(self):
         return f"{self.headline} ({self.uid})"
@@ -44,10 +48,13 @@ class Prompt(models.Model):
     result = models.CharField(max_length=10, choices=RESULT_CHOICES, null=True, blank=True)
     input_text = models.TextField()
     output_text = models.TextField(blank=True, default='')
-    llm_messages = models.JSONField(default=list, blank=True)
+    llm_messages = models.JSONField(default=list, blank=True)  # messages added by this prompt's run only
     created = models.DateTimeField(default=timezone.now)
     modified = models.DateTimeField(auto_now=True)
     files = models.ManyToManyField('File', blank=True)
+    # Lease of the worker currently running the prompt (see LLMWorker.claim_prompt)
+    worker_id = models.CharField(max_length=100, blank=True, default='')
+    lease_expires = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         ordering = ['created']
@@ -56,6 +63,21 @@ class Prompt(models.Model):
         return f"[{self.chat.uid}] {self.input_text:.30}..."
 
 
+class ChatSummary(models.Model):
+    """Summary of the first `turns` turns of a chat, sent to the LLM instead of those turns (see chat.history)."""
+
+    chat = models.ForeignKey(Chat, on_delete=models.CASCADE, related_name='summaries')
+    turns = models.PositiveIntegerField()
+    text = models.TextField()
+    created = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = [('chat', 'turns')]
+
+    def __str__(self):
+        return f"[{self.chat.uid}] summary of {self.turns} turns"
+
+
 def upload_to(instance, filename):
     """Generate upload path: <year>/<month>/<random6chars>/<original_filename>"""
     now = timezone.now()
@@ -63,11 +85,51 @@ def upload_to(instance, filename):
     return f"{now.year}/{now.month:02d}/{random_chars}/{filename}"
 
 
+def blob_path(sha256: str) -> str:
+    """Content-addressed path: blobs/<ab>/<cd>/<sha256>"""
+    return f"blobs/{sha256[:2]}/{sha256[2:4]}/{sha256}"
+
+
+class Blob(models.Model):
+    """Uploaded content stored once per SHA-256, shared by all File rows with that hash (see chat.blobs)."""
+
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = models.FileField()
+    size = models.BigIntegerField()
+    refcount = models.PositiveIntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.sha256} ({self.refcount} refs)"
+
+
 class File(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='files')
-    file = models.FileField(upload_to=upload_to)
+    file = models.FileField(upload_to=upload_to)  # blob path for deduplicated uploads
+    name = models.CharField(max_length=255, blank=True, default='')  # original filename
     media_type = models.CharField(max_length=100)
+    sha256 = models.CharField(max_length=64, blank=True, default='', db_index=True)  # empty for legacy uploads
+    size = models.BigIntegerField(null=True, blank=True)
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    @property
+    def filename(self):
+        return self.name or os.path.basename(self.file.name)
+
+    def __str__(self):
+        return f"{self.filename} ({self.user.username})"
+
+
+class Upload(models.Model):
+    """Resumable upload in progress - chunks are appended to a part file until complete (see chat.uploads)."""
+
+    uid = models.CharField(max_length=12, unique=True, default=generate_uid)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='uploads')
+    filename = models.CharField(max_length=255)
+    media_type = models.CharField(max_length=100, blank=True, default='')  # as declared by the client
+    size = models.BigIntegerField()
+    received = models.BigIntegerField(default=0)
+    created = models.DateTimeField(default=timezone.now)
+
     def __str__(self):
-        return f"{os.path.basename(self.file.name)} ({self.user.username})"
+        return f"{self.filename} ({self.received}/{self.size})"
@@ -0,0 +1,89 @@
+import asyncio
+import logging
+import redis
+import redis.asyncio as aioredis
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+class BasePromptQueue:
+    """Queue of prompt ids waiting to be picked up by the LLM worker."""
+
+    async def aenqueue(self, prompt_id: int):
+        """Push prompt id to the queue (called from async API views)."""
+        raise NotImplementedError
+
+    async def dequeue(self, timeout: float) -> int | None:
+        """Wait up to `timeout` seconds for the next prompt id."""
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class RedisPromptQueue(BasePromptQueue):
+    """Redis list based queue (LPUSH by the web process, BRPOP by workers)."""
+
+    key = 'prompts:queued'
+
+    def __init__(self):
+        self.redis_url = settings.REDIS_URL
+        self._connection = None
+
+    async def get_connection(self):
+        if self._connection is None:
+            self._connection = aioredis.from_url(self.redis_url)
+        return self._connection
+
+    async def aenqueue(self, prompt_id: int):
+        connection = await self.get_connection()
+        await connection.lpush(self.key, prompt_id)
+
+    async def dequeue(self, timeout: float) -> int | None:
+        connection = await self.get_connection()
+        item = await connection.brpop([self.key], timeout=timeout)
+        if item is None:
+            return None
+        _key, value = item
+        return int(value)
+
+    async def close(self):
+        if self._connection:
+            await self._connection.close()
+
+
+class InProcessPromptQueue(BasePromptQueue):
+    """In-memory queue - only useful when API and worker share a process (tests, dev)."""
+
+    def __init__(self):
+        self._items: asyncio.Queue[int] = asyncio.Queue()
+
+    async def aenqueue(self, prompt_id: int):
+        self._items.put_nowait(prompt_id)
+
+    async def dequeue(self, timeout: float) -> int | None:
+        try:
+            return await asyncio.wait_for(self._items.get(), timeout)
+        except TimeoutError:
+            return None
+
+
+def get_prompt_queue() -> BasePromptQueue:
+    queue_class = import_string(settings.PROMPT_QUEUE_BACKEND)
+    return queue_class()
+
+
+prompt_queue = get_prompt_queue()
+
+
+async def aenqueue_prompt(prompt_id: int):
+    """Hand the prompt to workers from an async view (autocommit - the prompt row is already saved).
+
+    Failures are not fatal - the worker recovery sweep still finds queued rows in the DB.
+    """
+    try:
+        await prompt_queue.aenqueue(prompt_id)
+    except redis.RedisError as e:
+        logger.warning("Error enqueueing prompt %s (left for the worker sweep): %s", prompt_id, e)
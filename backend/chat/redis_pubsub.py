@@ -1,14 +1,164 @@
+import re
 import json
+import asyncio
+import weakref
+from contextlib import AsyncExitStack
 import redis.asyncio as redis
 from django.conf import settings
 
 
+STREAM_ID_RE = re.compile(r'^\d+-\d+$')
+
+
+class Subscription:
+    """Bounded queue of (event_id, message) items for a single SSE client."""
+
+    def __init__(self, maxsize: int):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self.closed = False
+
+    def put(self, item, overflow: str) -> bool:
+        """Queue item, returns False if it was dropped."""
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(item)
+            return True
+        except asyncio.QueueFull:
+            if overflow == 'disconnect':
+                self.close()
+            return False
+
+    def close(self):
+        # Drop pending items, `None` tells the consumer to stop
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+        self.closed = True
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class SubscriptionHub:
+    """Per-process fan-out of chat messages to SSE clients.
+
+    All subscribers share one Redis pub/sub connection (or one XREAD loop in 'streams' mode),
+    so the number of Redis connections depends on web processes, not on open browser tabs.
+    """
+
+    def __init__(self, get_connection, mode: str):
+        self.get_connection = get_connection
+        self.mode = mode
+        self.queue_size = settings.REDIS_HUB_QUEUE_SIZE
+        self.overflow = settings.REDIS_HUB_OVERFLOW  # 'drop' or 'disconnect'
+        self.block_ms = settings.REDIS_HUB_BLOCK_MS
+        self.subscriptions: dict[str, set[Subscription]] = {}
+        self.stream_ids: dict[str, str] = {}  # stream key -> last read entry id
+        self.dropped = 0
+        self._pubsub = None
+        self._lock = asyncio.Lock()
+        self._has_subscriptions = asyncio.Event()
+        self._reader = None
+
+    async def subscribe(self, name: str) -> Subscription:
+        subscription = Subscription(self.queue_size)
+        async with self._lock:
+            if name not in self.subscriptions:
+                if self.mode == 'streams':
+                    connection = await self.get_connection()
+                    last = await connection.xrevrange(name, count=1)
+                    self.stream_ids[name] = last[0][0] if last else '0-0'
+                else:
+                    if self._pubsub is None:
+                        self._pubsub = (await self.get_connection()).pubsub()
+                    await self._pubsub.subscribe(name)
+                self.subscriptions[name] = set()
+            self.subscriptions[name].add(subscription)
+            self._has_subscriptions.set()
+
+        if self._reader is None or self._reader.done():
+            self._reader = asyncio.create_task(self.read_forever())
+        return subscription
+
+    async def unsubscribe(self, name: str, subscription: Subscription):
+        async with self._lock:
+            subscriptions = self.subscriptions.get(name)
+            if subscriptions is None:
+                return
+            subscriptions.discard(subscription)
+            if subscriptions:
+                return
+            del self.subscriptions[name]
+            if self.mode == 'streams':
+                self.stream_ids.pop(name, None)
+            elif self._pubsub is not None:
+                await self._pubsub.unsubscribe(name)
+            if not self.subscriptions:
+                self._has_subscriptions.clear()
+
+    def dispatch(self, name: str, event_id: str | None, message: dict):
+        for subscription in self.subscriptions.get(name, ()):
+            if not subscription.put((event_id, message), self.overflow):
+                self.dropped += 1
+
+    async def read_forever(self):
+        while True:
+            await self._has_subscriptions.wait()
+            try:
+                if self.mode == 'streams':
+                    await self.read_streams()
+                else:
+                    await self.read_pubsub()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error reading chat messages from Redis: {e}")
+                await asyncio.sleep(1)
+
+    async def read_pubsub(self):
+        message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+        if message and message['type'] == 'message':
+            self.dispatch(message['channel'], None, json.loads(message['data']))
+
+    async def read_streams(self):
+        connection = await self.get_connection()
+        response = await connection.xread(dict(self.stream_ids), block=self.block_ms, count=100)
+        for key, entries in response or []:
+            for entry_id, fields in entries:
+                if key in self.stream_ids:
+                    self.stream_ids[key] = entry_id
+                self.dispatch(key, entry_id, json.loads(fields['data']))
+
+    def stats(self) -> dict:
+        return {
+            'channels': len(self.subscriptions),
+            'subscribers': sum(len(s) for s in self.subscriptions.values()),
+            'dropped': self.dropped,
+        }
+
+
 class RedisPubSub:
-    """Redis client for pub/sub streaming functionality."""
+    """Redis client for pub/sub streaming functionality.
+
+    In 'streams' mode messages are appended to capped per-chat Redis Streams instead of PUBLISH,
+    so subscribers can resume from the last received entry id (SSE Last-Event-ID).
+    """
 
     def __init__(self):
         self.redis_url = settings.REDIS_URL
         self._connection = None
+        self.mode = settings.REDIS_PUBSUB_MODE
+        self.stream_maxlen = settings.REDIS_STREAM_MAXLEN
+        self.stream_ttl = settings.REDIS_STREAM_TTL
+        # Optional micro-batching of chunks (disabled when window is 0)
+        self.batch_window = settings.REDIS_PUBLISH_BATCH_WINDOW
+        self.batch_max_size = settings.REDIS_PUBLISH_BATCH_MAX_SIZE
+        self._batches: dict[str, list[tuple[int, str]]] = {}
+        self._flush_task = None
+        # Batches of a chat are taken and written under its lock, so its messages keep their order
+        self._locks: weakref.WeakValueDictionary[str, asyncio.Lock] = weakref.WeakValueDictionary()
+        self.hub = SubscriptionHub(self.get_connection, self.mode)
 
     async def get_connection(self):
         """Get or create Redis connection."""
@@ -16,9 +166,38 @@ class RedisPubSub:
             self._connection = redis.from_url(self.redis_url, decode_responses=True)
         return self._connection
 
+    def get_channel(self, chat_uid: str) -> str:
+        return f"chat:{chat_uid}"
+
+    def get_stream_key(self, chat_uid: str) -> str:
+        return f"chat:{chat_uid}:stream"
+
+    def get_lock(self, chat_uid: str) -> asyncio.Lock:
+        lock = self._locks.get(chat_uid)
+        if lock is None:
+            lock = self._locks[chat_uid] = asyncio.Lock()
+        return lock
+
+    def add_message(self, pipe, chat_uid: str, message: dict):
+        """Add publish command for the message to the pipeline."""
+        data = json.dumps(message)
+        if self.mode == 'streams':
+            key = self.get_stream_key(chat_uid)
+            pipe.xadd(key, {'data': data}, maxlen=self.stream_maxlen, approximate=True)
+            pipe.expire(key, self.stream_ttl)
+        else:
+            pipe.publish(self.get_channel(chat_uid), data)
+
+    async def send(self, chat_uid: str, message: dict):
+        connection = await self.get_connection()
+        async with connection.pipeline(transaction=False) as pipe:
+            self.add_message(pipe, chat_uid, message)
+            await pipe.execute()
+
     async def publish_chunk(self, chat_uid: str, prompt_id: int, chunk: str):
         """Publish a text chunk to the chat's Redis channel."""
-        connection = await self.get_connection()
+        if self.batch_window > 0:
+            return await self.add_to_batch(chat_uid, prompt_id, chunk)
 
         message = {
             'type': 'chunk',
@@ -26,42 +205,153 @@ class RedisPubSub:
             'chunk': chunk,
         }
 
-        channel = f"chat:{chat_uid}"
-        await connection.publish(channel, json.dumps(message))
+        await self.send(chat_uid, message)
+
+    async def add_to_batch(self, chat_uid: str, prompt_id: int, chunk: str):
+        """Collect chunk for the chat, it is published with others after `batch_window` seconds."""
+        batch = self._batches.setdefault(chat_uid, [])
+        batch.append((prompt_id, chunk))
+        if len(batch) >= self.batch_max_size:
+            await self.flush(chat_uid)
+        elif self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.batch_window)
+        self._flush_task = None
+        await self.flush()
+
+    async def flush(self, chat_uid: str | None = None):
+        """Publish pending batches (of one chat or all chats) in a single pipeline round-trip."""
+        chat_uids = [chat_uid] if chat_uid is not None else sorted(self._batches)
+        async with AsyncExitStack() as stack:
+            # Always locked in sorted order - flushes of all chats can't deadlock each other
+            for uid in chat_uids:
+                await stack.enter_async_context(self.get_lock(uid))
+            await self.write_batches(chat_uids)
+
+    async def write_batches(self, chat_uids: list[str]):
+        """Publish pending batches of the chats, the caller holds their locks."""
+        batches = {uid: self._batches.pop(uid) for uid in chat_uids if self._batches.get(uid)}
+        if not batches:
+            return
 
-    async def publish_status(self, chat_uid: str, prompt_id: int, status: str):
-        """Publish status update to the chat's Redis channel."""
         connection = await self.get_connection()
+        async with connection.pipeline(transaction=False) as pipe:
+            for uid, batch in batches.items():
+                message = {
+                    'type': 'chunks',
+                    'chunks': batch,  # [[prompt_id, chunk], ...]
+                }
+                self.add_message(pipe, uid, message)
+            await pipe.execute()
 
+    async def publish_status(self, chat_uid: str, prompt_id: int, status: str):
+        """Publish status update to the chat's Redis channel."""
         message = {
             'type': 'status',
             'prompt_id': prompt_id,
             'status': status,
         }
 
-        channel = f"chat:{chat_uid}"
-        await connection.publish(channel, json.dumps(message))
+        # Pending chunks (also the ones a timer flush is writing right now) must reach subscribers first
+        async with self.get_lock(chat_uid):
+            await self.write_batches([chat_uid])
+            await self.send(chat_uid, message)
 
-    async def subscribe_to_chat(self, chat_uid: str):
-        """Subscribe to a chat's Redis channel and yield messages."""
+    async def subscribe_to_chat(self, chat_uid: str, last_event_id: str | None = None):
+        """Subscribe to a chat and yield (event_id, message) tuples.
+
+        event_id is only set in 'streams' mode; passing it back as `last_event_id`
+        replays everything published after it.
+        """
+        if self.mode == 'streams':
+            async for item in self.read_stream(chat_uid, last_event_id):
+                yield item
+            return
+
+        channel = self.get_channel(chat_uid)
+        subscription = await self.hub.subscribe(channel)
+        try:
+            while True:
+                item = await subscription.get()
+                if item is None:
+                    # Disconnected as a slow consumer - messages were lost, client has to reload the chat
+                    yield None, {'type': 'resync'}
+                    return
+                _event_id, message = item
+                for data in unpack_message(message):
+                    yield None, data
+        finally:
+            await self.hub.unsubscribe(channel, subscription)
+
+    async def read_stream(self, chat_uid: str, last_event_id: str | None):
         connection = await self.get_connection()
-        pubsub = connection.pubsub()
+        key = self.get_stream_key(chat_uid)
 
-        channel = f"chat:{chat_uid}"
-        await pubsub.subscribe(channel)
+        if last_event_id and STREAM_ID_RE.match(last_event_id):
+            first = await connection.xrange(key, count=1)
+            if first and parse_stream_id(first[0][0]) > parse_stream_id(last_event_id):
+                # Entries after last_event_id were already trimmed - client has to reload the chat
+                yield None, {'type': 'resync'}
+            last_id = last_event_id
+        else:
+            last = await connection.xrevrange(key, count=1)
+            last_id = last[0][0] if last else '0-0'
 
+        # Live entries come from the hub, anything between last_id and the hub position is replayed here
+        subscription = await self.hub.subscribe(key)
         try:
-            async for message in pubsub.listen():
-                if message['type'] == 'message':
-                    yield json.loads(message['data'])
+            replay = await connection.xrange(key, min=f'({last_id}', max='+')
+            for entry_id, fields in replay:
+                last_id = entry_id
+                for item in unpack_stream_entry(entry_id, json.loads(fields['data'])):
+                    yield item
+
+            while True:
+                item = await subscription.get()
+                if item is None:
+                    return  # slow consumer - client reconnects with Last-Event-ID
+                entry_id, message = item
+                if parse_stream_id(entry_id) <= parse_stream_id(last_id):
+                    continue  # already replayed
+                last_id = entry_id
+                for item in unpack_stream_entry(entry_id, message):
+                    yield item
         finally:
-            await pubsub.unsubscribe(channel)
-            await pubsub.close()
+            await self.hub.unsubscribe(key, subscription)
 
     async def close(self):
         """Close Redis connection."""
         if self._connection:
+            await self.flush()
             await self._connection.close()
 
 
+def parse_stream_id(stream_id: str) -> tuple[int, int]:
+    ms, seq = stream_id.split('-')
+    return int(ms), int(seq)
+
+
+def unpack_stream_entry(entry_id: str, message: dict):
+    messages = unpack_message(message)
+    # Id goes on the last event of the entry, so a resume never skips a part of it
+    for i, data in enumerate(messages, 1):
+        yield (entry_id if i == len(messages) else None), data
+
+
+def unpack_message(message: dict) -> list[dict]:
+    """Turn a batched 'chunks' message into regular 'chunk' messages (one per consecutive prompt run)."""
+    if message['type'] != 'chunks':
+        return [message]
+
+    result = []
+    for prompt_id, chunk in message['chunks']:
+        if result and result[-1]['prompt_id'] == prompt_id:
+            result[-1]['chunk'] += chunk
+        else:
+            result.append({'type': 'chunk', 'prompt_id': prompt_id, 'chunk': chunk})
+    return result
+
+
 pubsub = RedisPubSub()
@@ -0,0 +1,234 @@
+import asyncio
+import hashlib
+from datetime import timedelta
+from pathlib import Path
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.files import File as DjangoFile
+from django.db.models import Sum
+from django.utils import timezone
+from ninja.errors import HttpError
+from chat.blobs import create_file
+from chat.models import File, Upload
+
+READ_SIZE = 1024 * 1024  # bytes read/written at a time - bounds memory used per upload
+SNIFF_SIZE = 2048
+
+MAGIC_NUMBERS = [
+    (b'%PDF-', 'application/pdf'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'PK\x03\x04', 'application/zip'),
+]
+
+TEXT_MEDIA_TYPES = {'application/json', 'application/xml', 'application/javascript', 'application/yaml'}
+
+
+def looks_like_text(head: bytes) -> bool:
+    if b'\x00' in head:
+        return False
+    try:
+        head.decode('utf-8')
+    except UnicodeDecodeError as e:
+        return e.start >= len(head) - 3  # multi-byte character cut at the end of the head
+    return True
+
+
+def sniff_media_type(head: bytes, declared: str) -> str:
+    """Media type from the first bytes of the content - the client's content type is only trusted for text."""
+    declared = (declared or '').split(';')[0].strip().lower()
+    for magic, media_type in MAGIC_NUMBERS:
+        if head.startswith(magic):
+            if media_type == 'application/zip' and declared.startswith('application/vnd.openxmlformats'):
+                return declared  # docx, xlsx, ... are zip files
+            return media_type
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    if looks_like_text(head):
+        if declared.startswith('text/') or declared in TEXT_MEDIA_TYPES:
+            return declared
+        return 'text/plain'
+    return 'application/octet-stream'
+
+
+class Scanner:
+    """SHA-256, size and head (for sniffing) of content, computed chunk by chunk."""
+
+    def __init__(self):
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.head = b''
+
+    def update(self, chunk: bytes):
+        self.digest.update(chunk)
+        self.size += len(chunk)
+        if len(self.head) < SNIFF_SIZE:
+            self.head += chunk[: SNIFF_SIZE - len(self.head)]
+
+    @property
+    def sha256(self) -> str:
+        return self.digest.hexdigest()
+
+
+class PartFile(DjangoFile):
+    """Completed part file - file system storage moves it into place instead of copying."""
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+async def check_upload_size(user, size: int):
+    """Raise 413 if the file is over UPLOAD_MAX_SIZE or would exceed the user's USER_STORAGE_QUOTA."""
+    if size > settings.UPLOAD_MAX_SIZE:
+        raise HttpError(413, f"File is too large (max {settings.UPLOAD_MAX_SIZE} bytes)")
+    if not settings.USER_STORAGE_QUOTA:
+        return
+    stored = await File.objects.filter(user=user).aaggregate(total=Sum('size'))
+    reserved = await Upload.objects.filter(user=user).aaggregate(total=Sum('size'))  # uploads in progress
+    if (stored['total'] or 0) + (reserved['total'] or 0) + size > settings.USER_STORAGE_QUOTA:
+        raise HttpError(413, "Storage quota exceeded")
+
+
+def store_scanned(user, content, name: str, declared_media_type: str, scanner: Scanner) -> File:
+    media_type = sniff_media_type(scanner.head, declared_media_type)
+    return create_file(user, content, name, media_type, scanner.sha256, scanner.size)
+
+
+async def store_upload(user, uploaded) -> File:
+    """Store a file uploaded in a single request."""
+    await check_upload_size(user, uploaded.size)
+
+    def store():
+        scanner = Scanner()
+        for chunk in uploaded.chunks(READ_SIZE):
+            scanner.update(chunk)
+        uploaded.seek(0)
+        return store_scanned(user, uploaded, uploaded.name, uploaded.content_type, scanner)
+
+    return await sync_to_async(store)()
+
+
+# Resumable uploads ----------------------------------------------------------------------------------------------
+# POST starts an upload, chunks are PUT in order at their offset (a failed chunk is simply sent again),
+# completing it stores the part file like a regular upload.
+
+# Hash state of uploads receiving chunks in this process, rebuilt from the part file otherwise
+_scanners: dict[str, Scanner] = {}
+
+
+def part_path(upload: Upload) -> Path:
+    return Path(settings.UPLOAD_PARTS_DIR) / f'{upload.uid}.part'
+
+
+def delete_part(upload: Upload):
+    _scanners.pop(upload.uid, None)
+    part_path(upload).unlink(missing_ok=True)
+
+
+async def expire_uploads(user):
+    """Drop the user's uploads not completed within UPLOAD_EXPIRY seconds."""
+    expired = Upload.objects.filter(user=user, created__lt=timezone.now() - timedelta(seconds=settings.UPLOAD_EXPIRY))
+    async for upload in expired:
+        delete_part(upload)
+        await upload.adelete()
+
+
+async def start_upload(user, filename: str, size: int, media_type: str) -> Upload:
+    await expire_uploads(user)
+    await check_upload_size(user, size)
+    upload = await Upload.objects.acreate(user=user, filename=filename, size=size, media_type=media_type)
+    part_path(upload).parent.mkdir(parents=True, exist_ok=True)
+    part_path(upload).touch()
+    return upload
+
+
+class ChunkTooLarge(Exception):
+    pass
+
+
+def write_chunk(path: Path, stream, offset: int, limit: int, scanner: Scanner | None) -> int:
+    """Write request body at offset (overwriting anything after it), return bytes written.
+
+    Bodies over `limit` bytes are rejected whatever their Content-Length said - the part file is
+    truncated back to `offset` and ChunkTooLarge raised.
+    """
+    written = 0
+    with open(path, 'r+b') as f:
+        f.seek(offset)
+        while chunk := stream.read(min(READ_SIZE, limit - written + 1)):
+            written += len(chunk)
+            if written > limit:
+                f.truncate(offset)
+                raise ChunkTooLarge
+            f.write(chunk)
+            if scanner is not None:
+                scanner.update(chunk)
+        f.truncate()
+    return written
+
+
+async def receive_chunk(upload: Upload, request, offset: int) -> Upload:
+    if offset != upload.received:
+        raise HttpError(409, f"Expected chunk at offset {upload.received}")
+    if not request.headers.get('Content-Length'):
+        raise HttpError(411, "Content-Length is required")
+    try:
+        length = int(request.headers['Content-Length'])
+    except ValueError:
+        raise HttpError(400, "Invalid Content-Length") from None
+    if length < 0:
+        raise HttpError(400, "Invalid Content-Length")
+    if length > settings.UPLOAD_CHUNK_MAX_SIZE:
+        raise HttpError(413, f"Chunk is too large (max {settings.UPLOAD_CHUNK_MAX_SIZE} bytes)")
+    if offset + length > upload.size:
+        raise HttpError(413, "Chunk exceeds the declared file size")
+
+    scanner = _scanners.get(upload.uid)
+    if offset == 0:
+        scanner = _scanners[upload.uid] = Scanner()
+    elif scanner is not None and scanner.size != offset:
+        scanner = None  # chunk was retried - rescan on completion
+        _scanners.pop(upload.uid, None)
+
+    # Content-Length is only what the client claims - the body itself is capped too
+    limit = min(settings.UPLOAD_CHUNK_MAX_SIZE, upload.size - offset)
+    try:
+        written = await asyncio.to_thread(write_chunk, part_path(upload), request, offset, limit, scanner)
+    except ChunkTooLarge:
+        _scanners.pop(upload.uid, None)
+        raise HttpError(413, "Chunk is larger than declared") from None
+    updated = await Upload.objects.filter(pk=upload.pk, received=offset).aupdate(received=offset + written)
+    if not updated:
+        _scanners.pop(upload.uid, None)
+        raise HttpError(409, "Upload was changed by another request")
+    upload.received = offset + written
+    return upload
+
+
+def scan_path(path: Path) -> Scanner:
+    scanner = Scanner()
+    with open(path, 'rb') as f:
+        while chunk := f.read(READ_SIZE):
+            scanner.update(chunk)
+    return scanner
+
+
+async def complete_upload(user, upload: Upload) -> File:
+    if upload.received != upload.size:
+        raise HttpError(409, f"Upload is incomplete ({upload.received} of {upload.size} bytes)")
+    path = part_path(upload)
+    scanner = _scanners.pop(upload.uid, None)
+
+    def store():
+        nonlocal scanner
+        if scanner is None or scanner.size != upload.size:
+            scanner = scan_path(path)
+        with open(path, 'rb') as f:
+            file_obj = store_scanned(user, PartFile(f), upload.filename, upload.media_type, scanner)
+        path.unlink(missing_ok=True)  # content was already stored - part file was not moved
+        upload.delete()
+        return file_obj
+
+    return await sync_to_async(store)()
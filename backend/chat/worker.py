@@ -1,49 +1,358 @@
 import os
 import json
+import time
+import uuid
+import socket
 import asyncio
 import traceback
+import contextlib
+import redis.asyncio as aioredis
+from collections import Counter, OrderedDict, deque
+from dataclasses import dataclass, field
+from datetime import timedelta
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.core.management.color import make_style
-from pydantic_ai import Agent
-from pydantic_ai.models.openai import OpenAIModel
-from pydantic_ai.messages import ModelMessagesTypeAdapter
-from pydantic_ai.providers.openrouter import OpenRouterProvider
-from pydantic_ai import BinaryContent
+from django.db import close_old_connections
+from django.db.models import F, Q, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
 from chat.models import Prompt
+from chat.attachments import attachment_cache, load_attachment
+from chat.history import compact_history, history_cache, load_history
 from chat.redis_pubsub import pubsub
+from chat.prompt_queue import prompt_queue
+from llms.agent import ChatDeps, chat_agent
+from llms.catalog import model_catalog
+from llms.clients import INVALIDATE_CHANNEL, llm_clients
 from llms.dummy import create_dummy_model
 from llms.tools import available_tools
 from userprofile.utils import get_userprofile
 
 
+class LeaseLost(Exception):
+    """The prompt's lease expired and it was re-queued - another worker may be running it now."""
+
+
+@dataclass
+class Job:
+    prompt_id: int
+    user_id: int
+    provider: str
+    submitted: float = field(default_factory=time.monotonic)
+    started: float | None = None
+
+
+class PromptScheduler:
+    """Runs prompts with a global concurrency cap plus per-user and per-provider caps.
+
+    Pending jobs are grouped by user and dispatched with weighted round-robin, so a user
+    with thousands of queued prompts can't starve everyone else. Each user has at most
+    max_pending_per_user jobs pending - the rest of their prompts are left queued in the DB
+    (the user is marked `overflowed`) so the shared queue keeps draining for other users.
+    """
+
+    def __init__(
+        self,
+        run_job,
+        max_running: int,
+        max_per_user: int,
+        max_per_provider: int,
+        max_pending: int,
+        max_pending_per_user: int,
+    ):
+        self.run_job = run_job  # async callable(prompt_id)
+        self.max_running = max_running
+        self.max_per_user = max_per_user
+        self.max_per_provider = max_per_provider
+        self.max_pending = max_pending
+        self.max_pending_per_user = max_pending_per_user
+        self.weights: dict[int, int] = dict(settings.LLM_WORKER_USER_WEIGHTS)
+
+        self.pending: OrderedDict[int, deque[Job]] = OrderedDict()  # user_id -> jobs, in round-robin order
+        self.pending_ids: set[int] = set()
+        self.overflowed: set[int] = set()  # users with prompts left queued in the DB
+        self.running: dict[int, Job] = {}
+        self.running_per_user: Counter[int] = Counter()
+        self.running_per_provider: Counter[str] = Counter()
+        self.tasks: set[asyncio.Task] = set()
+        self.has_room = asyncio.Event()
+        self.has_room.set()
+
+        # metrics
+        self.started_count = 0
+        self.finished_count = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def __contains__(self, prompt_id: int) -> bool:
+        return prompt_id in self.running or prompt_id in self.pending_ids
+
+    @property
+    def room(self) -> int:
+        return max(self.max_pending - len(self.pending_ids), 0)
+
+    def user_room(self, user_id: int) -> int:
+        return max(self.max_pending_per_user - len(self.pending.get(user_id, ())), 0)
+
+    def refillable_users(self) -> list[int]:
+        """Overflowed users whose pending jobs dropped to half of their cap."""
+        return [user_id for user_id in self.overflowed if self.user_room(user_id) >= self.max_pending_per_user // 2]
+
+    def submit(self, job: Job) -> bool:
+        """Add job to the user's pending jobs, False if the user has too many already (job stays queued in the DB)."""
+        if job.prompt_id in self:
+            return True
+        if not self.user_room(job.user_id):
+            self.overflowed.add(job.user_id)
+            return False
+        self.pending.setdefault(job.user_id, deque()).append(job)
+        self.pending_ids.add(job.prompt_id)
+        if not self.room:
+            self.has_room.clear()
+        self.dispatch()
+        return True
+
+    def dispatch(self):
+        """Start as many pending jobs as the caps allow, one round-robin pass over users at a time."""
+        while self.pending and len(self.running) < self.max_running:
+            started = False
+            for user_id in list(self.pending):
+                if len(self.running) >= self.max_running:
+                    break
+                jobs = self.pending[user_id]
+                quota = self.weights.get(user_id, 1)
+                served = False
+                while (
+                    quota
+                    and len(self.running) < self.max_running
+                    and self.running_per_user[user_id] < self.max_per_user
+                ):
+                    job = self._pop_startable(jobs)
+                    if job is None:
+                        break
+                    self._start(job)
+                    served = started = True
+                    quota -= 1
+                if not jobs:
+                    del self.pending[user_id]
+                elif served:
+                    self.pending.move_to_end(user_id)  # next turn goes to other users
+            if not started:
+                break
+
+    def _pop_startable(self, jobs: deque[Job]) -> Job | None:
+        for job in jobs:
+            if self.running_per_provider[job.provider] < self.max_per_provider:
+                jobs.remove(job)
+                return job
+        return None
+
+    def _start(self, job: Job):
+        self.pending_ids.discard(job.prompt_id)
+        self.has_room.set()
+        job.started = time.monotonic()
+        wait = job.started - job.submitted
+        self.started_count += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+        self.running[job.prompt_id] = job
+        self.running_per_user[job.user_id] += 1
+        self.running_per_provider[job.provider] += 1
+        task = asyncio.create_task(self.run_job(job.prompt_id))
+        self.tasks.add(task)
+        task.add_done_callback(lambda t: self._finish(job, t))
+
+    def _finish(self, job: Job, task: asyncio.Task):
+        self.tasks.discard(task)
+        del self.running[job.prompt_id]
+        self.running_per_user[job.user_id] -= 1
+        self.running_per_provider[job.provider] -= 1
+        self.finished_count += 1
+        self.dispatch()
+
+    def metrics(self) -> dict:
+        return {
+            'pending': len(self.pending_ids),
+            'pending_users': len(self.pending),
+            'overflowed_users': len(self.overflowed),
+            'running': len(self.running),
+            'running_per_provider': {k: v for k, v in self.running_per_provider.items() if v},
+            'started': self.started_count,
+            'finished': self.finished_count,
+            'avg_wait': self.total_wait / self.started_count if self.started_count else 0.0,
+            'max_wait': self.max_wait,
+        }
+
+
 class LLMWorker:
     def __init__(self):
         self.running = True
         self.style = make_style()
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}'
+        self.scheduler = PromptScheduler(
+            self.process_prompt,
+            max_running=settings.LLM_WORKER_MAX_RUNNING,
+            max_per_user=settings.LLM_WORKER_MAX_RUNNING_PER_USER,
+            max_per_provider=settings.LLM_WORKER_MAX_RUNNING_PER_PROVIDER,
+            max_pending=settings.LLM_WORKER_MAX_PENDING,
+            max_pending_per_user=settings.LLM_WORKER_MAX_PENDING_PER_USER,
+        )
 
     async def run(self):
-        self.log('Starting LLM worker...', 'SUCCESS')
+        self.log(f'Starting LLM worker {self.worker_id}...', 'SUCCESS')
+        sweep_interval = settings.PROMPT_QUEUE_SWEEP_INTERVAL
+        next_sweep = 0.0
+        heartbeat = asyncio.create_task(self.renew_leases())
+        invalidations = asyncio.create_task(self.listen_for_key_invalidations())
+        catalog_refresh = asyncio.create_task(model_catalog.run(lambda: self.running))
         while self.running:
             try:
-                await self.process_queued_prompts()
-                await asyncio.sleep(0.2)
+                # Recovery sweep: re-queues prompts of dead workers and picks up prompts that never made it to the queue
+                if time.monotonic() >= next_sweep:
+                    await self.requeue_expired_prompts()
+                    await self.process_queued_prompts()
+                    llm_clients.evict_idle()
+                    # No request cycle here - recycle DB connections past CONN_MAX_AGE / broken ones (pool: return them)
+                    await sync_to_async(close_old_connections)()
+                    self.log_metrics()
+                    next_sweep = time.monotonic() + sweep_interval
+
+                refill = self.scheduler.refillable_users()
+                if refill and self.scheduler.room:
+                    # Users whose prompts were left in the DB have room again - don't wait for the sweep
+                    await self.process_queued_prompts(refill)
+
+                timeout = max(next_sweep - time.monotonic(), 0.1)
+                if not self.scheduler.room:
+                    # Backpressure (only with many users - each has its own cap): leave prompts for other workers
+                    with contextlib.suppress(asyncio.TimeoutError):
+                        await asyncio.wait_for(self.scheduler.has_room.wait(), timeout)
+                    continue
+
+                prompt_id = await prompt_queue.dequeue(timeout=timeout)
+                if prompt_id is not None:
+                    await self.submit_prompt(prompt_id)
             except Exception as e:
                 self.log(f'Error in worker loop: {e}', 'ERROR')
                 self.log(traceback.format_exc(), 'ERROR')
                 await asyncio.sleep(3)  # Wait longer on error
+        heartbeat.cancel()
+        invalidations.cancel()
+        catalog_refresh.cancel()
+        await llm_clients.aclose()
+
+    async def process_queued_prompts(self, user_ids: list[int] | None = None):
+        """Submit queued prompts from the DB, the oldest max_pending_per_user of each user."""
+        queued = Prompt.objects.filter(status='queued')
+        if user_ids is not None:
+            queued = queued.filter(chat__user_id__in=user_ids)
+            self.scheduler.overflowed.difference_update(user_ids)  # set again if they still don't fit
+        per_user_rank = Window(RowNumber(), partition_by=F('chat__user_id'), order_by=F('created').asc())
+        queued = queued.annotate(rank=per_user_rank).filter(rank__lte=self.scheduler.max_pending_per_user)
+        known_ids = set(self.scheduler.running) | self.scheduler.pending_ids
+        async for prompt_id, user_id, model in queued.order_by('created').values_list(
+            'id', 'chat__user_id', 'chat__model'
+        ):
+            if not self.scheduler.room:
+                break
+            if prompt_id not in known_ids:
+                self.scheduler.submit(Job(prompt_id, user_id, model.split(':', 1)[0]))
+
+    async def submit_prompt(self, prompt_id: int):
+        row = (
+            await Prompt.objects.filter(id=prompt_id, status='queued')
+            .values_list('chat__user_id', 'chat__model')
+            .afirst()
+        )
+        if row is None:
+            return  # already handled
+        user_id, model = row
+        self.scheduler.submit(Job(prompt_id, user_id, model.split(':', 1)[0]))
+
+    def log_metrics(self):
+        metrics = self.scheduler.metrics()
+        if metrics['pending'] or metrics['running']:
+            self.log(
+                'Scheduler: {pending} pending ({pending_users} users), {running} running, '
+                'avg wait {avg_wait:.3f}s, max wait {max_wait:.3f}s'.format(**metrics)
+            )
+            self.log(
+                'History cache: {entries} chats, {size} bytes, {hits} hits, {misses} misses'.format(
+                    **history_cache.stats()
+                )
+            )
+            self.log(
+                'Attachment cache: {entries} files, {size} bytes, {hits} hits, {misses} misses'.format(
+                    **attachment_cache.stats()
+                )
+            )
+            self.log(
+                'LLM clients: {providers} providers, {models} models, {hits} hits, {misses} misses'.format(
+                    **llm_clients.stats()
+                )
+            )
 
-    async def process_queued_prompts(self):
-        prompts = []
-        async for prompt in Prompt.objects.filter(status='queued'):
-            prompts.append(prompt)
-
-        # Process each prompt
-        for prompt in prompts:
-            asyncio.create_task(self.process_prompt(prompt))
-
-    async def process_prompt(self, prompt: Prompt):
+    async def listen_for_key_invalidations(self):
+        """Drop pooled clients of API keys replaced in user profiles."""
+        while self.running:
+            try:
+                connection = aioredis.from_url(settings.REDIS_URL)
+                async with connection.pubsub() as channel:
+                    await channel.subscribe(INVALIDATE_CHANNEL)
+                    async for message in channel.listen():
+                        if message['type'] == 'message':
+                            llm_clients.invalidate(message['data'].decode())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.log(f'Error listening for API key invalidations: {e}', 'WARNING')
+                await asyncio.sleep(3)
+
+    def lease_expiry(self):
+        return timezone.now() + timedelta(seconds=settings.PROMPT_LEASE_SECONDS)
+
+    async def claim_prompt(self, prompt_id: int) -> bool:
+        """Atomically move prompt from queued to running under this worker's lease."""
+        claimed = await Prompt.objects.filter(id=prompt_id, status='queued').aupdate(
+            status='running',
+            worker_id=self.worker_id,
+            lease_expires=self.lease_expiry(),
+            modified=timezone.now(),
+        )
+        return claimed == 1
+
+    async def renew_leases(self):
+        """Keep leases of in-flight prompts alive while this worker is running."""
+        while self.running:
+            await asyncio.sleep(settings.PROMPT_LEASE_SECONDS / 3)
+            if not self.scheduler.running:
+                continue
+            try:
+                await Prompt.objects.filter(
+                    id__in=list(self.scheduler.running), status='running', worker_id=self.worker_id
+                ).aupdate(lease_expires=self.lease_expiry())
+            except Exception as e:
+                self.log(f'Error renewing leases: {e}', 'ERROR')
+
+    async def requeue_expired_prompts(self):
+        """Reaper: put prompts of crashed/stopped workers back to the queue."""
+        expired = Q(lease_expires__lt=timezone.now()) | Q(lease_expires__isnull=True)
+        count = await Prompt.objects.filter(expired, status='running').aupdate(
+            status='queued', worker_id='', lease_expires=None, output_text='', modified=timezone.now()
+        )
+        if count:
+            self.log(f'Re-queued {count} prompt(s) with expired lease', 'WARNING')
+
+    async def process_prompt(self, prompt_id: int):
+        prompt = None
+        history = None
         try:
-            # Access prompt data directly (since we're in async context)
-            prompt_id = prompt.id
+            # Mark as running - only one worker wins the claim
+            if not await self.claim_prompt(prompt_id):
+                return  # already taken by another worker (or by us via queue + sweep)
+
             # Use select_related to fetch the chat and user in one query (async hook)
             prompt = await Prompt.objects.select_related('chat__user').aget(id=prompt_id)
             chat_uid = prompt.chat.uid
@@ -51,10 +360,6 @@ class LLMWorker:
             chat_user = prompt.chat.user
             chat_tools = prompt.chat.tools
 
-            # Mark as running
-            prompt.status = 'running'
-            await prompt.asave()
-
             # Publish status update
             await pubsub.publish_status(chat_uid, prompt_id, 'running')
 
@@ -66,85 +371,107 @@ class LLMWorker:
             # Parse provider and model
             provider, model_name = chat_model.split(':', 1)
 
-            # Get system prompt from chat if available
-            system_prompt = ()  # empty
-            if prompt.chat.system_prompt:
-                system_prompt = prompt.chat.system_prompt.text
-
-            # Tools
-            tools = []
+            # System prompt and tools are passed to the shared agent at run time
             for tool_name in chat_tools:
                 assert tool_name in available_tools, f"Tool '{tool_name}' not found in available tools"
-                tools.append(available_tools[tool_name]['callback'])
+            deps = ChatDeps(system_prompt=prompt.chat.system_prompt, tools=chat_tools)
 
-            # 1) Create appropriate agent based on provider --------------------------------------------------------
+            # 1) Get model for the provider (clients are pooled per API key) ----------------------------------------
             if provider == 'dummy':
                 agent_model = create_dummy_model()
-                agent = Agent(model=agent_model, system_prompt=system_prompt, tools=tools)
 
             elif provider == 'openai':
                 key = get_openai_key(user_profile)
-                agent = Agent(model=model_name, api_key=key, system_prompt=system_prompt, tools=tools)
+                agent_model = llm_clients.get_model(provider, model_name, key)
 
             elif provider == 'openrouter':
                 key = get_openrouter_key(user_profile)
-                agent_model = OpenAIModel(
-                    model_name,
-                    provider=OpenRouterProvider(api_key=user_profile.openrouter_key),
-                )
-                agent = Agent(model=agent_model, system_prompt=system_prompt, tools=tools)
+                agent_model = llm_clients.get_model(provider, model_name, key)
             else:
                 raise ValueError(f"Unknown provider: {provider}")
 
             # 2) Load previous prompt messages context ----------------------------------------------------------
-            history = None
-            prev_prompt = (
-                await Prompt.objects.filter(chat_id=prompt.chat_id).exclude(id=prompt.id).order_by('-created').afirst()
-            )
-            if prev_prompt:
-                history = ModelMessagesTypeAdapter.validate_python(prev_prompt.llm_messages)
-
-            # print(history)
+            history = await load_history(prompt.chat_id, prompt.id)
+            # Long chats are summarized/truncated to fit the model context (full history stays cached)
+            model_history = await compact_history(prompt.chat_id, history, agent_model)
 
             # 3) Build prompt with files -----------------------------------------------------------------------
             prompt_content = [prompt.input_text]
 
-            # Add file attachments
-            async for file in prompt.files.all():
-                # Read file content
-                file_content = file.file.read()
-                prompt_content.append(BinaryContent(data=file_content, media_type=file.media_type))
+            # Add file attachments (read in a thread pool, cached by file id)
+            files = [file async for file in prompt.files.all()]
+            prompt_content.extend(await asyncio.gather(*(load_attachment(file) for file in files)))
 
             # 4) Process with pydantic-ai streaming -------------------------------------------------------------
-            async with agent.run_stream(prompt_content, message_history=history) as result:
+            # Chunks are published right away, but output_text is only written every
+            # PROMPT_FLUSH_INTERVAL seconds / PROMPT_FLUSH_CHARS characters (and once at the end)
+            last_flush = time.monotonic()
+            unsaved_chars = 0
+            async with chat_agent.run_stream(
+                prompt_content, message_history=model_history, model=agent_model, deps=deps
+            ) as result:
                 async for chunk in result.stream_text(delta=True):
                     # Append each chunk to output_text
                     prompt.output_text += chunk
-                    await prompt.asave()
                     await pubsub.publish_chunk(chat_uid, prompt_id, chunk)
 
-                prompt.llm_messages = json.loads(result.all_messages_json().decode('utf-8'))
+                    unsaved_chars += len(chunk)
+                    if (
+                        unsaved_chars >= settings.PROMPT_FLUSH_CHARS
+                        or time.monotonic() - last_flush >= settings.PROMPT_FLUSH_INTERVAL
+                    ):
+                        await self.save_owned(prompt, ['output_text'])
+                        last_flush = time.monotonic()
+                        unsaved_chars = 0
+
+                # Only messages of this run - history is the concatenation of previous prompts' messages
+                prompt.llm_messages = json.loads(result.new_messages_json().decode('utf-8'))
+                new_messages = result.new_messages()
 
-            # Mark as finished
+            # Mark as finished (final flush of output_text)
             prompt.status = 'finished'
             prompt.result = 'success'
-            await prompt.asave()
+            await self.save_owned(prompt, ['status', 'result', 'output_text', 'llm_messages'])
+            # Next turn in this chat starts from the already parsed messages
+            history_cache.put(prompt.chat_id, prompt_id, (history or []) + new_messages)
 
             # Publish completion status
             await pubsub.publish_status(chat_uid, prompt_id, 'finished')
 
             self.log(f'Completed prompt {prompt_id}', 'SUCCESS')
 
+        except LeaseLost:
+            # Another worker owns the prompt now - leave its output and status alone
+            self.log(f'Lost the lease of prompt {prompt_id}, abandoning it', 'WARNING')
+
         except Exception as e:
             self.log(f'Error processing prompt: {e}', 'ERROR')
             self.log(traceback.format_exc(), 'ERROR')
 
+            if prompt is None:
+                return
+
             # Mark as failed
             prompt.output_text += traceback.format_exc()
             # TODO: ^ this not really nice - but let's keep it simple for now
             prompt.status = 'finished'
             prompt.result = 'failure'
-            await prompt.asave()
+            try:
+                await self.save_owned(prompt, ['status', 'result', 'output_text'])
+                if history is not None:
+                    history_cache.put(prompt.chat_id, prompt_id, history)  # failed prompt adds no messages
+            except LeaseLost:
+                self.log(f'Lost the lease of prompt {prompt_id}, abandoning it', 'WARNING')
+
+    async def save_owned(self, prompt: Prompt, fields: list[str]):
+        """Write fields of a running prompt only while this worker holds its lease, raise LeaseLost otherwise."""
+        values = {field: getattr(prompt, field) for field in fields}
+        prompt.modified = values['modified'] = timezone.now()
+        updated = await Prompt.objects.filter(id=prompt.id, status='running', worker_id=self.worker_id).aupdate(
+            **values
+        )
+        if not updated:
+            raise LeaseLost(prompt.id)
 
     def stop(self):
         self.running = False
@@ -0,0 +1,36 @@
+from dataclasses import dataclass, field
+from pydantic_ai import Agent, RunContext
+from pydantic_ai.tools import Tool, ToolDefinition
+from llms.tools import available_tools
+
+
+@dataclass
+class ChatDeps:
+    """Per-prompt settings passed to the shared agent at run time."""
+
+    system_prompt: str = ''
+    tools: list[str] = field(default_factory=list)
+
+
+def make_tool(name: str, callback) -> Tool:
+    if isinstance(callback, Tool):
+        return callback
+    return Tool(callback, name=name)
+
+
+async def select_tools(ctx: RunContext[ChatDeps], tool_defs: list[ToolDefinition]) -> list[ToolDefinition]:
+    """Only offer the tools enabled for the chat."""
+    return [tool_def for tool_def in tool_defs if tool_def.name in ctx.deps.tools]
+
+
+# Shared by all prompts - model, system prompt and tools are chosen per run
+chat_agent = Agent(
+    deps_type=ChatDeps,
+    tools=[make_tool(name, tool['callback']) for name, tool in available_tools.items()],
+    prepare_tools=select_tools,
+)
+
+
+@chat_agent.instructions
+def chat_system_prompt(ctx: RunContext[ChatDeps]) -> str:
+    return ctx.deps.system_prompt
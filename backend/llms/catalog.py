@@ -0,0 +1,200 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import re
+from bisect import bisect_left
+from pathlib import Path
+from django.conf import settings
+from llms.providers import STATIC_PROVIDERS, fetch_providers_and_models
+
+CHECK_INTERVAL = 1.0  # seconds between checks of the snapshot file for changes
+RETRY_INTERVAL = 60  # seconds between refresh attempts of a web process after errors
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+
+def tokenize(text: str) -> list[str]:
+    return TOKEN_RE.findall((text or '').lower())
+
+
+class CatalogIndex:
+    """Models of a snapshot flattened into arrays, with inverted indexes of the tokens of their names/ids
+    (`name_terms`) and of all their text (`terms`). Built once per snapshot, searches only touch the
+    postings of the query tokens.
+
+    Query tokens match words by prefix: "gpt 4o" matches "GPT-4o Mini". Name/id matches come first.
+    """
+
+    def __init__(self, providers: list):
+        self.models = []
+        for provider in providers:
+            for model in provider['models']:
+                self.models.append({**model, 'provider': provider['provider']})
+        self.providers = [model['provider'] for model in self.models]
+        self.context_lengths = [model.get('context_length') for model in self.models]
+        self.prompt_prices = [model.get('prompt_price') for model in self.models]
+        self.name_terms = self.build_terms(lambda model: f"{model['name']} {model['id']}")
+        self.terms = self.build_terms(
+            lambda model: f"{model['name']} {model['id']} {model['description']} {model['provider']}"
+        )
+
+    def build_terms(self, text) -> tuple[list[str], dict[str, frozenset[int]]]:
+        postings: dict[str, set[int]] = {}
+        for position, model in enumerate(self.models):
+            for token in tokenize(text(model)):
+                postings.setdefault(token, set()).add(position)
+        return sorted(postings), {term: frozenset(positions) for term, positions in postings.items()}
+
+    @staticmethod
+    def lookup(terms: tuple[list[str], dict[str, frozenset[int]]], tokens: list[str]) -> set[int]:
+        """Positions of models having a word starting with each of the tokens."""
+        words, postings = terms
+        result = None
+        for token in tokens:
+            matches = set()
+            i = bisect_left(words, token)
+            while i < len(words) and words[i].startswith(token):
+                matches |= postings[words[i]]
+                i += 1
+            result = matches if result is None else result & matches
+            if not result:
+                break
+        return result or set()
+
+    def search(
+        self,
+        q: str = '',
+        providers: list[str] | None = None,
+        min_context_length: int | None = None,
+        max_prompt_price: float | None = None,
+    ) -> list[int]:
+        """Positions of matching models, best first."""
+        tokens = tokenize(q)
+        if tokens:
+            name_matches = self.lookup(self.name_terms, tokens)
+            matches = self.lookup(self.terms, tokens)
+            positions = sorted(name_matches) + sorted(matches - name_matches)
+        else:
+            positions = range(len(self.models))
+
+        result = []
+        for position in positions:
+            if providers and self.providers[position] not in providers:
+                continue
+            if min_context_length is not None and (self.context_lengths[position] or 0) < min_context_length:
+                continue
+            if max_prompt_price is not None:
+                price = self.prompt_prices[position]
+                if price is None or price > max_prompt_price:
+                    continue
+            result.append(position)
+        return result
+
+
+class ModelCatalog:
+    """Snapshot of the models of all providers, served by GET /models.
+
+    The LLM worker refreshes it every MODEL_CATALOG_REFRESH_INTERVAL seconds and writes it to
+    MODEL_CATALOG_PATH, web processes reload the file when it changes. Requests never wait for
+    providers - without a snapshot only the static providers are listed until the first refresh.
+    """
+
+    def __init__(self, path: Path, refresh_interval: float):
+        self.path = Path(path)
+        self.refresh_interval = refresh_interval
+        self.providers: list = STATIC_PROVIDERS
+        self.content = json.dumps(STATIC_PROVIDERS).encode()
+        self.etag = self.make_etag(self.content)
+        self.index = CatalogIndex(self.providers)
+        self.mtime = 0.0  # of the loaded snapshot, 0 - none loaded
+        self._mtime_ns = None
+        self._checked = 0.0
+        self._refreshing: asyncio.Task | None = None
+        self._retry_after = 0.0
+        self.refreshes = 0
+        self.errors = 0
+
+    @staticmethod
+    def make_etag(content: bytes) -> str:
+        return f'"{hashlib.sha256(content).hexdigest()[:32]}"'
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.mtime if self.mtime else float('inf')
+
+    def load(self) -> bool:
+        """Reload the snapshot if the file changed since it was last loaded."""
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        if stat.st_mtime_ns == self._mtime_ns:
+            return False
+        content = self.path.read_bytes()
+        providers = json.loads(content)
+        index = CatalogIndex(providers)
+        self.providers, self.content, self.etag, self.index = providers, content, self.make_etag(content), index
+        self.mtime = stat.st_mtime
+        self._mtime_ns = stat.st_mtime_ns
+        return True
+
+    def save(self, content: bytes):
+        # Write and rename, so readers never see a partly written file
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(f'{self.path.name}.{os.getpid()}.tmp')
+        tmp_path.write_bytes(content)
+        os.replace(tmp_path, self.path)
+
+    async def refresh(self):
+        """Fetch model lists from the providers and store them as the new snapshot."""
+        providers = await fetch_providers_and_models()
+        content = json.dumps(providers).encode()
+        await asyncio.to_thread(self.save, content)
+        await asyncio.to_thread(self.load)
+        self.refreshes += 1
+
+    async def refresh_if_stale(self, max_age: float | None = None) -> bool:
+        """Refresh if the snapshot is older than max_age (default the refresh interval). Errors keep the old one."""
+        await asyncio.to_thread(self.load)
+        if self.age < (self.refresh_interval if max_age is None else max_age):
+            return False
+        try:
+            await self.refresh()
+        except Exception as e:
+            self.errors += 1
+            print(f"Error refreshing model catalog: {e}")
+            return False
+        return True
+
+    async def get(self) -> 'ModelCatalog':
+        """Current snapshot (reloaded if the worker wrote a new one).
+
+        If no worker has refreshed it for several intervals, it's refreshed in the background here.
+        """
+        if time.monotonic() - self._checked >= CHECK_INTERVAL:
+            self._checked = time.monotonic()
+            await asyncio.to_thread(self.load)
+        max_age = self.refresh_interval * 3
+        if self.age > max_age and time.monotonic() >= self._retry_after:
+            self._retry_after = time.monotonic() + RETRY_INTERVAL
+            self._refreshing = asyncio.create_task(self.refresh_if_stale(max_age))
+        return self
+
+    async def run(self, running):
+        """Refresh the snapshot on schedule while running() is true (LLM worker task)."""
+        while running():
+            await self.refresh_if_stale()
+            await asyncio.sleep(max(self.refresh_interval - self.age, RETRY_INTERVAL))
+
+    def stats(self) -> dict:
+        return {
+            'providers': len(self.providers),
+            'models': sum(len(provider['models']) for provider in self.providers),
+            'age': self.age,
+            'refreshes': self.refreshes,
+            'errors': self.errors,
+        }
+
+
+model_catalog = ModelCatalog(settings.MODEL_CATALOG_PATH, settings.MODEL_CATALOG_REFRESH_INTERVAL)
@@ -0,0 +1,125 @@
+import time
+import hashlib
+import importlib.util
+import httpx
+import redis
+from django.conf import settings
+from pydantic_ai.models import Model
+from pydantic_ai.models.openai import OpenAIModel
+from pydantic_ai.providers.openai import OpenAIProvider
+from pydantic_ai.providers.openrouter import OpenRouterProvider
+
+INVALIDATE_CHANNEL = 'llm:clients:invalidate'
+
+PROVIDER_CLASSES = {
+    'openai': OpenAIProvider,
+    'openrouter': OpenRouterProvider,
+}
+
+
+def key_fingerprint(api_key: str) -> str:
+    """Stable id of an API key - the key itself is never used as a dict key or sent around."""
+    return hashlib.sha256(api_key.encode()).hexdigest()[:16]
+
+
+class ClientPool:
+    """Provider clients and models shared by all prompts of the worker.
+
+    One keep-alive HTTP client per provider (HTTP/2 when `h2` is installed) is shared by all API keys,
+    providers are keyed by (provider, key) and models by (provider, model, key). Entries not used for
+    LLM_CLIENT_IDLE_TIMEOUT seconds are evicted, entries of a changed key can be invalidated right away.
+    """
+
+    def __init__(self, idle_timeout: float):
+        self.idle_timeout = idle_timeout
+        self._http_clients: dict[str, httpx.AsyncClient] = {}
+        self._providers: dict[tuple[str, str], list] = {}  # (provider, fingerprint) -> [provider, last used]
+        self._models: dict[tuple[str, str, str], list] = {}  # (provider, model, fingerprint) -> [model, last used]
+        self.hits = 0
+        self.misses = 0
+
+    def get_http_client(self, provider: str) -> httpx.AsyncClient:
+        client = self._http_clients.get(provider)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                http2=importlib.util.find_spec('h2') is not None,
+                timeout=httpx.Timeout(timeout=600, connect=5),
+                limits=httpx.Limits(max_keepalive_connections=20, keepalive_expiry=settings.LLM_CLIENT_IDLE_TIMEOUT),
+            )
+            self._http_clients[provider] = client
+        return client
+
+    def get_provider(self, provider: str, api_key: str):
+        key = (provider, key_fingerprint(api_key))
+        entry = self._providers.get(key)
+        if entry is None:
+            provider_class = PROVIDER_CLASSES[provider]
+            entry = [provider_class(api_key=api_key, http_client=self.get_http_client(provider)), 0]
+            self._providers[key] = entry
+        entry[1] = time.monotonic()
+        return entry[0]
+
+    def get_model(self, provider: str, model_name: str, api_key: str) -> Model:
+        key = (provider, model_name, key_fingerprint(api_key))
+        entry = self._models.get(key)
+        if entry is None:
+            self.misses += 1
+            entry = [OpenAIModel(model_name, provider=self.get_provider(provider, api_key)), 0]
+            self._models[key] = entry
+        else:
+            self.hits += 1
+        entry[1] = time.monotonic()
+        return entry[0]
+
+    def evict_idle(self) -> int:
+        """Drop providers and models not used within the idle timeout."""
+        deadline = time.monotonic() - self.idle_timeout
+        evicted = 0
+        for entries in (self._models, self._providers):
+            for key in [key for key, (_value, last_used) in entries.items() if last_used < deadline]:
+                del entries[key]
+                evicted += 1
+        return evicted
+
+    def invalidate(self, fingerprint: str) -> int:
+        """Drop providers and models using the API key with this fingerprint."""
+        evicted = 0
+        for entries in (self._models, self._providers):
+            for key in [key for key in entries if key[-1] == fingerprint]:
+                del entries[key]
+                evicted += 1
+        return evicted
+
+    def stats(self) -> dict:
+        return {
+            'providers': len(self._providers),
+            'models': len(self._models),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+    async def aclose(self):
+        self._models.clear()
+        self._providers.clear()
+        for client in self._http_clients.values():
+            await client.aclose()
+        self._http_clients.clear()
+
+
+llm_clients = ClientPool(idle_timeout=settings.LLM_CLIENT_IDLE_TIMEOUT)
+
+
+def invalidate_api_keys(*api_keys: str):
+    """Tell workers to drop clients of replaced API keys (called from sync API views)."""
+    fingerprints = [key_fingerprint(api_key) for api_key in api_keys if api_key]
+    if not fingerprints:
+        return
+    for fingerprint in fingerprints:
+        llm_clients.invalidate(fingerprint)  # in case worker runs in this process
+    try:
+        with redis.from_url(settings.REDIS_URL) as connection:
+            for fingerprint in fingerprints:
+                connection.publish(INVALIDATE_CHANNEL, fingerprint)
+    except redis.RedisError as e:
+        # Not fatal - clients of an old key are never picked again and get evicted when idle
+        print(f"Error publishing API key invalidation: {e}")
@@ -1,47 +1,61 @@
 import httpx
 from utils.cache import cache
 
-
-def get_providers_and_models():
-    """Get list of available LLM models grouped by provider."""
-    providers = [
-        {
-            "provider": "dummy",
-            "models": [{"name": "Dummy Model", "id": "dummy:dummy", "description": "Test model with random text"}],
-        },
-        {
-            "provider": "openai",
-            "models": [
-                {"name": "GPT-4o", "id": "openai:gpt-4o", "description": "OpenAI GPT-4o"},
-                {"name": "GPT-4o Mini", "id": "openai:gpt-4o-mini", "description": "OpenAI GPT-4o Mini"},
-            ],
-        },
-    ]
-
-    # Fetch OpenRouter models with caching
-    openrouter_models = get_openrouter_models()
-    providers.append({"provider": "openrouter", "models": openrouter_models})
-
-    return providers
-
-
-@cache(ttl=30 * 60)  # 30 minutes
-def get_openrouter_models() -> list:
-    response = httpx.get("https://openrouter.ai/api/v1/models", timeout=5.0)
-    if response.status_code != 200:
-        print(f"Error fetching OpenRouter models: {response.status_code} {response.text}")
-        return []
+OPENROUTER_MODELS_URL = "https://openrouter.ai/api/v1/models"
+
+# Providers with a fixed list of models
+STATIC_PROVIDERS = [
+    {
+        "provider": "dummy",
+        "models": [{"name": "Dummy Model", "id": "dummy:dummy", "description": "Test model with random text"}],
+    },
+    {
+        "provider": "openai",
+        "models": [
+            {"name": "GPT-4o", "id": "openai:gpt-4o", "description": "OpenAI GPT-4o"},
+            {"name": "GPT-4o Mini", "id": "openai:gpt-4o-mini", "description": "OpenAI GPT-4o Mini"},
+        ],
+    },
+]
+
+
+async def fetch_providers_and_models() -> list:
+    """Get list of available LLM models grouped by provider (fetched from the providers - see llms.catalog)."""
+    openrouter_models = await fetch_openrouter_models()
+    return STATIC_PROVIDERS + [{"provider": "openrouter", "models": openrouter_models}]
+
+
+# Scheduled refreshes of all workers (and web processes' fallback refreshes) share one request to OpenRouter -
+# across processes with the Redis cache backend
+@cache(ttl=5 * 60)
+async def fetch_openrouter_models() -> list:
+    async with httpx.AsyncClient(timeout=30.0) as client:
+        response = await client.get(OPENROUTER_MODELS_URL)
+    response.raise_for_status()
     openrouter_data = response.json()
     result = []
 
     # Get all models
     for model in openrouter_data.get("data", []):
+        pricing = model.get("pricing") or {}
         result.append(
             {
                 "name": model.get("name", model["id"]),
                 "id": f"openrouter:{model['id']}",
                 "description": model.get("description", "")[:100],
+                "context_length": model.get("context_length"),
+                "prompt_price": price_per_million(pricing.get("prompt")),
+                "completion_price": price_per_million(pricing.get("completion")),
             }
         )
 
     return result
+
+
+def price_per_million(price_per_token: str | None) -> float | None:
+    """USD per million tokens from OpenRouter's per token price string (negative - variable price)."""
+    try:
+        price = float(price_per_token)
+    except (TypeError, ValueError):
+        return None
+    return round(price * 1_000_000, 4) if price >= 0 else None
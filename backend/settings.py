@@ -56,12 +56,49 @@ TEMPLATES = [
 # WSGI_APPLICATION = 'wsgi.application'
 
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / '../files/db.sqlite3',
+# Database: DB_ENGINE 'sqlite' (file DB_NAME) or 'postgresql' (DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT)
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite')
+
+if DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'mymychat'),
+            'USER': os.environ.get('DB_USER', 'mymychat'),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', 'localhost'),
+            'PORT': os.environ.get('DB_PORT', '5432'),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {},
+        }
     }
-}
+    # DB_POOL_MAX_SIZE > 0 - psycopg connection pool per process (connections go back to the pool when closed),
+    # otherwise persistent connections reused for DB_CONN_MAX_AGE seconds
+    DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', 0))
+    if DB_POOL_MAX_SIZE:
+        DATABASES['default']['OPTIONS']['pool'] = {
+            'min_size': int(os.environ.get('DB_POOL_MIN_SIZE', 2)),
+            'max_size': DB_POOL_MAX_SIZE,
+            'timeout': float(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        }
+    else:
+        DATABASES['default']['CONN_MAX_AGE'] = int(os.environ.get('DB_CONN_MAX_AGE', 600))
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DB_NAME', BASE_DIR / '../files/db.sqlite3'),
+            'OPTIONS': {
+                # Seconds to wait for another process' write lock (busy_timeout) instead of "database is locked"
+                'timeout': float(os.environ.get('SQLITE_BUSY_TIMEOUT', 20)),
+                # Take the write lock when a transaction starts - upgrading a read lock later can't wait for it
+                'transaction_mode': 'IMMEDIATE',
+            },
+        }
+    }
+    # WAL: readers don't block the writer (web process and LLM worker share the file), fsync only at checkpoints
+    if os.environ.get('SQLITE_WAL', '1') == '1':
+        DATABASES['default']['OPTIONS']['init_command'] = 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;'
 
 
 AUTH_PASSWORD_VALIDATORS = [
@@ -104,3 +141,80 @@ ALLOWED_HOSTS = ['*']
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REDIS_URL = os.environ.get('REDIS_URL', 'redis://127.0.0.1:6379')
+
+# LLM worker job queue: chat.prompt_queue.RedisPromptQueue or chat.prompt_queue.InProcessPromptQueue
+PROMPT_QUEUE_BACKEND = os.environ.get('PROMPT_QUEUE_BACKEND', 'chat.prompt_queue.RedisPromptQueue')
+# How often (seconds) the worker scans the DB for queued prompts missed by the queue
+PROMPT_QUEUE_SWEEP_INTERVAL = float(os.environ.get('PROMPT_QUEUE_SWEEP_INTERVAL', 10))
+# Workers hold a renewable lease on running prompts, expired leases are re-queued
+PROMPT_LEASE_SECONDS = int(os.environ.get('PROMPT_LEASE_SECONDS', 60))
+
+# LLM worker scheduling limits (per worker process)
+LLM_WORKER_MAX_RUNNING = int(os.environ.get('LLM_WORKER_MAX_RUNNING', 50))
+LLM_WORKER_MAX_RUNNING_PER_USER = int(os.environ.get('LLM_WORKER_MAX_RUNNING_PER_USER', 3))
+LLM_WORKER_MAX_RUNNING_PER_PROVIDER = int(os.environ.get('LLM_WORKER_MAX_RUNNING_PER_PROVIDER', 30))
+LLM_WORKER_MAX_PENDING = int(os.environ.get('LLM_WORKER_MAX_PENDING', 500))
+# Prompts of a user beyond this many pending ones are left queued in the DB (keeps the queue draining for others)
+LLM_WORKER_MAX_PENDING_PER_USER = int(os.environ.get('LLM_WORKER_MAX_PENDING_PER_USER', 20))
+# user id -> number of prompts dispatched per round-robin turn (default 1)
+LLM_WORKER_USER_WEIGHTS = {}
+# Streaming output is persisted every N seconds or N characters instead of on every token
+PROMPT_FLUSH_INTERVAL = float(os.environ.get('PROMPT_FLUSH_INTERVAL', 0.5))
+PROMPT_FLUSH_CHARS = int(os.environ.get('PROMPT_FLUSH_CHARS', 2000))
+
+# Micro-batching of streamed chunks: window in seconds (0 - publish every chunk right away) and max chunks per batch
+REDIS_PUBLISH_BATCH_WINDOW = float(os.environ.get('REDIS_PUBLISH_BATCH_WINDOW', 0))
+REDIS_PUBLISH_BATCH_MAX_SIZE = int(os.environ.get('REDIS_PUBLISH_BATCH_MAX_SIZE', 50))
+
+# Chat stream transport: 'pubsub' (fire and forget) or 'streams' (Redis Streams, resumable with Last-Event-ID)
+REDIS_PUBSUB_MODE = os.environ.get('REDIS_PUBSUB_MODE', 'pubsub')
+REDIS_STREAM_MAXLEN = int(os.environ.get('REDIS_STREAM_MAXLEN', 2000))  # entries kept per chat
+REDIS_STREAM_TTL = int(os.environ.get('REDIS_STREAM_TTL', 60 * 60))  # seconds after last message
+# SSE subscribers share one Redis connection per web process; slow clients get a bounded queue
+REDIS_HUB_QUEUE_SIZE = int(os.environ.get('REDIS_HUB_QUEUE_SIZE', 1000))
+REDIS_HUB_OVERFLOW = os.environ.get('REDIS_HUB_OVERFLOW', 'disconnect')  # 'disconnect' or 'drop'
+REDIS_HUB_BLOCK_MS = int(os.environ.get('REDIS_HUB_BLOCK_MS', 250))  # XREAD block time in 'streams' mode
+
+# LLM worker in-memory cache of parsed conversation history (approximate bytes)
+HISTORY_CACHE_MAX_BYTES = int(os.environ.get('HISTORY_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+# History sent to the model is compacted above this many (estimated) tokens, 0 disables compaction;
+# older turns are replaced by a stored summary, up to HISTORY_KEEP_TURNS recent turns are kept verbatim
+HISTORY_MAX_TOKENS = int(os.environ.get('HISTORY_MAX_TOKENS', 32000))
+HISTORY_KEEP_TURNS = int(os.environ.get('HISTORY_KEEP_TURNS', 10))
+
+# LLM worker keeps provider clients/models per API key, dropped after this many idle seconds
+LLM_CLIENT_IDLE_TIMEOUT = float(os.environ.get('LLM_CLIENT_IDLE_TIMEOUT', 10 * 60))
+
+# LLM worker reads attachments in a thread pool and caches their content (bytes)
+ATTACHMENT_READ_THREADS = int(os.environ.get('ATTACHMENT_READ_THREADS', 4))
+ATTACHMENT_CACHE_MAX_BYTES = int(os.environ.get('ATTACHMENT_CACHE_MAX_BYTES', 128 * 1024 * 1024))
+
+# Uploads: max file size, max chunk of a resumable upload, per-user storage quota (0 - unlimited)
+UPLOAD_MAX_SIZE = int(os.environ.get('UPLOAD_MAX_SIZE', 100 * 1024 * 1024))
+UPLOAD_CHUNK_MAX_SIZE = int(os.environ.get('UPLOAD_CHUNK_MAX_SIZE', 8 * 1024 * 1024))
+USER_STORAGE_QUOTA = int(os.environ.get('USER_STORAGE_QUOTA', 1024 * 1024 * 1024))
+# Part files of resumable uploads (same file system as MEDIA_ROOT, completed parts are moved), dropped after UPLOAD_EXPIRY seconds
+UPLOAD_PARTS_DIR = os.environ.get('UPLOAD_PARTS_DIR', BASE_DIR / '../files/uploads')
+UPLOAD_EXPIRY = int(os.environ.get('UPLOAD_EXPIRY', 24 * 60 * 60))
+
+# Uploaded files download: '' - streamed by Django, 'x-accel-redirect' (nginx internal location
+# at MEDIA_ACCEL_REDIRECT_PREFIX aliased to MEDIA_ROOT) or 'x-sendfile' (Apache/lighttpd)
+MEDIA_OFFLOAD = os.environ.get('MEDIA_OFFLOAD', '')
+MEDIA_ACCEL_REDIRECT_PREFIX = os.environ.get('MEDIA_ACCEL_REDIRECT_PREFIX', '/protected-media/')
+# Lifetime in seconds of signed file links (fetched by the client right before opening a file)
+FILE_URL_MAX_AGE = int(os.environ.get('FILE_URL_MAX_AGE', 5 * 60))
+
+# Authentication cache (per process): verified tokens and users, changes in other processes show up after the TTL
+AUTH_CACHE_TTL = float(os.environ.get('AUTH_CACHE_TTL', 60))
+AUTH_CACHE_MAX_SIZE = int(os.environ.get('AUTH_CACHE_MAX_SIZE', 10000))
+
+# Function result cache (utils.cache): utils.cache.MemoryCacheBackend (per process LRU of CACHE_MAX_SIZE entries)
+# or utils.cache.RedisCacheBackend (shared by all processes at REDIS_URL)
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'utils.cache.MemoryCacheBackend')
+CACHE_MAX_SIZE = int(os.environ.get('CACHE_MAX_SIZE', 1000))
+# Expired entries are kept this many seconds to be returned when refreshing them fails
+CACHE_STALE_IF_ERROR = int(os.environ.get('CACHE_STALE_IF_ERROR', 24 * 60 * 60))
+
+# Model list served by GET /models: refreshed by the LLM worker every N seconds and stored in this file
+MODEL_CATALOG_PATH = os.environ.get('MODEL_CATALOG_PATH', BASE_DIR / '../files/model_catalog.json')
+MODEL_CATALOG_REFRESH_INTERVAL = float(os.environ.get('MODEL_CATALOG_REFRESH_INTERVAL', 30 * 60))
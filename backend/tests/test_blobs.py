@@ -0,0 +1,71 @@
+import hashlib
+import pytest
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection
+from chat import blobs
+from chat.blobs import acquire_blob, release_blob
+from chat.models import Blob, blob_path
+
+CONTENT = b'attachment'
+SHA256 = hashlib.sha256(CONTENT).hexdigest()
+
+
+@pytest.fixture(autouse=True)
+def media_root(settings, tmp_path):
+    settings.MEDIA_ROOT = tmp_path
+
+
+@pytest.mark.django_db
+def test_content_is_stored_outside_of_transactions(monkeypatch):
+    save = default_storage.save
+
+    def checked_save(name, content):
+        # the test runs in a transaction - a transaction of acquire_blob would be a savepoint in it
+        assert not connection.savepoint_ids
+        return save(name, content)
+
+    monkeypatch.setattr(default_storage, 'save', checked_save)
+    blob = acquire_blob(SHA256, len(CONTENT), ContentFile(CONTENT))
+    assert default_storage.open(blob.file.name).read() == CONTENT
+    acquire_blob(SHA256, len(CONTENT))
+    assert Blob.objects.get(sha256=SHA256).refcount == 2
+
+
+@pytest.mark.django_db
+def test_last_release_deletes_the_content(django_capture_on_commit_callbacks):
+    acquire_blob(SHA256, len(CONTENT), ContentFile(CONTENT))
+    with django_capture_on_commit_callbacks(execute=True):
+        release_blob(SHA256)
+    assert not Blob.objects.filter(sha256=SHA256).exists()
+    assert not default_storage.exists(blob_path(SHA256))
+
+
+@pytest.mark.django_db
+def test_acquire_before_the_pending_delete_keeps_the_content(django_capture_on_commit_callbacks):
+    acquire_blob(SHA256, len(CONTENT), ContentFile(CONTENT))
+    with django_capture_on_commit_callbacks() as callbacks:
+        release_blob(SHA256)
+    acquire_blob(SHA256, len(CONTENT), ContentFile(CONTENT))
+    for callback in callbacks:  # the delete of the released blob runs after the new reference
+        callback()
+    assert Blob.objects.get(sha256=SHA256).refcount == 1
+    assert default_storage.exists(blob_path(SHA256))
+
+
+@pytest.mark.django_db
+def test_content_deleted_while_acquiring_is_stored_again(monkeypatch, django_capture_on_commit_callbacks):
+    acquire_blob(SHA256, len(CONTENT), ContentFile(CONTENT))
+    with django_capture_on_commit_callbacks() as callbacks:
+        release_blob(SHA256)
+    store_blob_content = blobs.store_blob_content
+
+    def store_then_delete(name, content):
+        store_blob_content(name, content)  # finds the content still stored
+        while callbacks:
+            callbacks.pop()()
+
+    monkeypatch.setattr(blobs, 'store_blob_content', store_then_delete)
+    acquire_blob(SHA256, len(CONTENT), ContentFile(CONTENT))
+    assert Blob.objects.get(sha256=SHA256).refcount == 1
+    assert default_storage.open(blob_path(SHA256)).read() == CONTENT
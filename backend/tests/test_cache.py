@@ -0,0 +1,110 @@
+import asyncio
+import threading
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from utils import cache as cache_module
+from utils.cache import MemoryCacheBackend, cache, clear_cache
+
+
+@pytest.fixture(autouse=True)
+def backend(monkeypatch):
+    backend = MemoryCacheBackend()
+    monkeypatch.setattr(cache_module, '_backend', backend)
+    return backend
+
+
+def test_concurrent_misses_compute_once():
+    calls = []
+    release = threading.Event()
+
+    @cache(ttl=60)
+    def load():
+        calls.append(1)
+        release.wait(5)
+        return 'value'
+
+    with ThreadPoolExecutor(10) as executor:
+        results = [executor.submit(load) for _ in range(10)]
+        release.set()
+        assert [result.result() for result in results] == ['value'] * 10
+    assert len(calls) == 1
+
+
+def test_concurrent_async_misses_compute_once():
+    calls = []
+
+    @cache(ttl=60)
+    async def load():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 'value'
+
+    async def main():
+        return await asyncio.gather(*(load() for _ in range(10)))
+
+    assert asyncio.run(main()) == ['value'] * 10
+    assert len(calls) == 1
+
+
+def test_stale_hit_refreshes_once_and_every_caller_gets_a_value(backend):
+    values = iter(['old', 'new'])
+    calls = []
+    refreshing = threading.Event()
+    release = threading.Event()
+
+    @cache(ttl=0, stale=60)  # stale right away
+    def load():
+        calls.append(1)
+        if len(calls) == 2:
+            refreshing.set()
+            release.wait(5)
+        return next(values)
+
+    assert load() == 'old'
+    assert [load() for _ in range(5)] == ['old'] * 5  # the first one started the refresh
+    assert refreshing.wait(5)
+    backend.clear()  # a miss while the refresh is running waits for it
+    with ThreadPoolExecutor(1) as executor:
+        missed = executor.submit(load)
+        release.set()
+        assert missed.result(5) == 'new'
+    assert len(calls) == 2
+
+
+def test_error_falls_back_to_the_stale_value():
+    calls = []
+
+    @cache(ttl=0)  # expired right away, kept as fallback for CACHE_STALE_IF_ERROR
+    def load():
+        calls.append(1)
+        if len(calls) > 1:
+            raise ValueError('provider down')
+        return 'old'
+
+    assert load() == 'old'
+    assert load() == 'old'
+    assert load.cache.stats()['errors'] == 1
+
+
+def test_error_without_a_stale_value_is_raised():
+    @cache(ttl=60)
+    def load():
+        raise ValueError('provider down')
+
+    with pytest.raises(ValueError):
+        load()
+
+
+def test_lock_held_elsewhere_is_not_released(backend, monkeypatch):
+    monkeypatch.setattr(cache_module, 'LOCK_TIMEOUT', 0.1)
+    unlocked = []
+    monkeypatch.setattr(backend, 'lock', lambda key, timeout: False)  # another process is loading it
+    monkeypatch.setattr(backend, 'unlock', unlocked.append)
+
+    @cache(ttl=60)
+    def load():
+        return 'value'
+
+    assert load() == 'value'
+    assert unlocked == []
+    clear_cache(load)
@@ -0,0 +1,114 @@
+import os
+import json
+import time
+import asyncio
+import pytest
+from llms import catalog as catalog_module
+from llms.catalog import CatalogIndex, ModelCatalog
+
+PROVIDERS = [
+    {
+        'provider': 'openai',
+        'models': [
+            {'name': 'GPT-4o', 'id': 'openai:gpt-4o', 'description': 'OpenAI GPT-4o, rival of Claude'},
+            {'name': 'GPT-4o Mini', 'id': 'openai:gpt-4o-mini', 'description': 'OpenAI GPT-4o Mini'},
+        ],
+    },
+    {
+        'provider': 'openrouter',
+        'models': [
+            {
+                'name': 'Claude Sonnet',
+                'id': 'openrouter:anthropic/claude-sonnet',
+                'description': 'Fast model, better than gpt 4o at code',
+                'context_length': 200000,
+                'prompt_price': 3.0,
+            },
+            {
+                'name': 'Llama 3 8B',
+                'id': 'openrouter:meta-llama/llama-3-8b',
+                'description': 'Small open model',
+                'context_length': 8192,
+                'prompt_price': 0.05,
+            },
+        ],
+    },
+]
+
+
+@pytest.fixture
+def snapshot(tmp_path):
+    path = tmp_path / 'models.json'
+    path.write_text(json.dumps(PROVIDERS))
+    return path
+
+
+def test_snapshot_is_loaded_from_disk(snapshot):
+    catalog = ModelCatalog(snapshot, refresh_interval=3600)
+    assert catalog.load()
+    assert catalog.providers == PROVIDERS
+    assert catalog.content == snapshot.read_bytes()
+    assert catalog.etag == ModelCatalog.make_etag(snapshot.read_bytes())
+    assert len(catalog.index.models) == 4
+    assert not catalog.load()  # unchanged file isn't parsed again
+
+
+def test_refresh_replaces_the_snapshot(snapshot, monkeypatch):
+    catalog = ModelCatalog(snapshot, refresh_interval=3600)
+    catalog.load()
+    etag = catalog.etag
+
+    async def fetch():
+        return PROVIDERS[:1]
+
+    monkeypatch.setattr(catalog_module, 'fetch_providers_and_models', fetch)
+    assert asyncio.run(catalog.refresh_if_stale(max_age=0))
+    assert catalog.providers == PROVIDERS[:1]
+    assert catalog.etag != etag
+    assert json.loads(snapshot.read_text()) == PROVIDERS[:1]
+
+
+def test_failed_refresh_keeps_the_old_snapshot(snapshot, monkeypatch):
+    old = time.time() - 2 * 3600
+    os.utime(snapshot, (old, old))
+    catalog = ModelCatalog(snapshot, refresh_interval=3600)
+
+    async def fetch():
+        raise ConnectionError('OpenRouter is down')
+
+    monkeypatch.setattr(catalog_module, 'fetch_providers_and_models', fetch)
+    assert not asyncio.run(catalog.refresh_if_stale())
+    assert catalog.errors == 1
+    assert catalog.providers == PROVIDERS
+    assert catalog.etag == ModelCatalog.make_etag(snapshot.read_bytes())
+    assert json.loads(snapshot.read_text()) == PROVIDERS
+
+
+def search_ids(q: str = '', **filters) -> list[str]:
+    index = CatalogIndex(PROVIDERS)
+    return [index.models[position]['id'] for position in index.search(q, **filters)]
+
+
+def test_search_matches_word_prefixes():
+    assert search_ids('gpt 4o mi') == ['openai:gpt-4o-mini']
+    assert search_ids('LLAMA') == ['openrouter:meta-llama/llama-3-8b']
+
+
+def test_search_miss():
+    assert search_ids('gemini') == []
+    assert search_ids('gpt llama') == []  # every token has to match
+
+
+def test_name_matches_rank_before_description_matches():
+    # GPT-4o comes first in the catalog but only mentions Claude in its description
+    assert search_ids('claude') == ['openrouter:anthropic/claude-sonnet', 'openai:gpt-4o']
+    assert search_ids('gpt 4o') == ['openai:gpt-4o', 'openai:gpt-4o-mini', 'openrouter:anthropic/claude-sonnet']
+
+
+def test_search_filters():
+    assert search_ids(min_context_length=100000) == ['openrouter:anthropic/claude-sonnet']
+    assert search_ids(max_prompt_price=1) == ['openrouter:meta-llama/llama-3-8b']
+    assert search_ids('model', providers=['openrouter']) == [
+        'openrouter:anthropic/claude-sonnet',
+        'openrouter:meta-llama/llama-3-8b',
+    ]
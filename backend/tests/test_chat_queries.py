@@ -0,0 +1,45 @@
+import pytest
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from auth.auth import create_jwt_token
+from chat.models import Chat, File, Prompt
+
+
+def create_chat(user: User, prompts: int) -> Chat:
+    chat = Chat.objects.create(headline='Queries', model='dummy:dummy', user=user, is_shared=True)
+    for i in range(prompts):
+        prompt = Prompt.objects.create(chat=chat, input_text=f'Question {i}', output_text='Answer', status='finished')
+        prompt.files.add(File.objects.create(user=user, file=f'uploads/{i}.txt', media_type='text/plain', size=1))
+    return chat
+
+
+def count_queries(path: str, **headers) -> int:
+    with CaptureQueriesContext(connection) as queries:
+        response = Client().get(path, headers=headers)
+    assert response.status_code == 200
+    return len(queries)
+
+
+@pytest.fixture
+def user():
+    return User.objects.create(username='queries@example.com')
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('query', ['', '?limit=10', '?limit=10&summary=true'])
+def test_get_chat_queries_do_not_grow_with_prompts(user, query):
+    headers = {'Authorization': f'Bearer {create_jwt_token(user.id)}'}
+    short, long = create_chat(user, 3), create_chat(user, 30)
+    Client().get('/api/profile', headers=headers)  # the authenticated user is cached after the first request
+    assert count_queries(f'/api/chats/{short.uid}{query}', **headers) == 3
+    assert count_queries(f'/api/chats/{long.uid}{query}', **headers) == 3
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('query', ['', '?limit=10', '?limit=10&summary=true'])
+def test_get_shared_chat_queries_do_not_grow_with_prompts(user, query):
+    short, long = create_chat(user, 3), create_chat(user, 30)
+    assert count_queries(f'/api/chats/{short.uid}/shared{query}') == 3
+    assert count_queries(f'/api/chats/{long.uid}/shared{query}') == 3
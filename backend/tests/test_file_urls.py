@@ -0,0 +1,65 @@
+import pytest
+from django.contrib.auth.models import User
+from django.test import Client
+from auth.auth import create_jwt_token
+from chat.models import File
+
+
+@pytest.fixture
+def user():
+    return User.objects.create(username='files@example.com')
+
+
+@pytest.fixture
+def create_file(settings, tmp_path, user):
+    settings.MEDIA_ROOT = tmp_path
+
+    def create(name: str, media_type: str) -> File:
+        (tmp_path / name).write_bytes(b'<script>alert(1)</script>')
+        return File.objects.create(user=user, file=name, media_type=media_type, size=25)
+
+    return create
+
+
+def signed_url(user: User, file: File) -> str:
+    response = Client().post(
+        f'/api/chats/files/{file.id}/url', headers={'Authorization': f'Bearer {create_jwt_token(user.id)}'}
+    )
+    assert response.status_code == 200
+    return response.json()['url']
+
+
+@pytest.mark.django_db
+def test_signed_url_serves_the_file(user, create_file):
+    file = create_file('a.png', 'image/png')
+    response = Client().get(signed_url(user, file))
+    assert response.status_code == 200
+    assert response['Content-Disposition'].startswith('inline')
+    assert 'Content-Security-Policy' not in response
+
+
+@pytest.mark.django_db
+def test_expired_or_forged_signed_url_is_rejected(settings, user, create_file):
+    file = create_file('a.png', 'image/png')
+    url = signed_url(user, file)
+    assert Client().get(url + 'x').status_code == 403
+    settings.FILE_URL_MAX_AGE = -1
+    assert Client().get(url).status_code == 403
+
+
+@pytest.mark.django_db
+def test_token_in_query_is_not_accepted(user, create_file):
+    file = create_file('a.png', 'image/png')
+    response = Client().get(f'/api/chats/files/{file.id}/content?token={create_jwt_token(user.id)}')
+    assert response.status_code == 401
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('media_type', ['text/html', 'image/svg+xml', 'text/plain'])
+def test_active_content_is_downloaded_in_a_sandbox(user, create_file, media_type):
+    file = create_file('a.html', media_type)
+    response = Client().get(signed_url(user, file))
+    assert response.status_code == 200
+    assert response['Content-Disposition'].startswith('attachment')
+    assert response['Content-Security-Policy'] == 'sandbox'
+    assert response['X-Content-Type-Options'] == 'nosniff'
@@ -0,0 +1,47 @@
+import pytest
+from asgiref.sync import async_to_sync
+from pydantic_ai.messages import ModelRequest, ModelResponse, SystemPromptPart, TextPart, UserPromptPart
+from django.contrib.auth.models import User
+from pydantic_ai.messages import ModelMessagesTypeAdapter
+from chat.history import compact_history, history_cache, load_history
+from chat.models import Chat, Prompt
+
+
+def turn(text: str, answer: str = 'OK') -> list:
+    return [ModelRequest(parts=[UserPromptPart(text)]), ModelResponse(parts=[TextPart(answer)])]
+
+
+@pytest.mark.django_db
+def test_short_history_is_not_compacted(settings):
+    settings.HISTORY_MAX_TOKENS = 1000
+    history = turn('Hello') + turn('How are you?')
+    assert async_to_sync(compact_history)(1, history, model=None) is history
+
+
+@pytest.mark.django_db
+def test_single_turn_over_budget_is_sent_as_is(settings):
+    # e.g. a first message with a pasted document - nothing older to summarize
+    settings.HISTORY_MAX_TOKENS = 1000
+    history = [ModelRequest(parts=[SystemPromptPart('Be brief.'), UserPromptPart('x' * 200_000)])]
+    history.append(ModelResponse(parts=[TextPart('OK')]))
+    assert async_to_sync(compact_history)(1, history, model=None) == history
+
+
+@pytest.mark.django_db
+def test_history_of_a_running_prompt_is_not_cached():
+    history_cache.clear()
+    chat = Chat.objects.create(
+        headline='History', model='dummy:dummy', user=User.objects.create(username='history@example.com')
+    )
+    first = Prompt.objects.create(chat=chat, input_text='Hello', status='finished')
+    first.llm_messages = ModelMessagesTypeAdapter.dump_python(turn('Hello'), mode='json')
+    first.save()
+    # e.g. a retried prompt, the previous one is still streaming
+    second = Prompt.objects.create(chat=chat, input_text='How are you?', status='running')
+    third = Prompt.objects.create(chat=chat, input_text='And now?', status='queued')
+
+    assert len(async_to_sync(load_history)(chat.id, third.id)) == 2
+    second.llm_messages = ModelMessagesTypeAdapter.dump_python(turn('How are you?'), mode='json')
+    second.status = 'finished'
+    second.save()
+    assert len(async_to_sync(load_history)(chat.id, third.id)) == 4
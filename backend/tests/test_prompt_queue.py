@@ -0,0 +1,68 @@
+import asyncio
+import pytest
+import redis
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from chat import prompt_queue as prompt_queue_module
+from chat import worker as worker_module
+from chat.models import Chat, Prompt
+from chat.prompt_queue import InProcessPromptQueue, aenqueue_prompt, get_prompt_queue
+from chat.redis_pubsub import pubsub
+from chat.worker import LLMWorker
+
+
+@pytest.fixture
+def queue(settings, monkeypatch):
+    settings.PROMPT_QUEUE_BACKEND = 'chat.prompt_queue.InProcessPromptQueue'
+    settings.PROMPT_QUEUE_SWEEP_INTERVAL = 3600  # only the startup sweep reads the DB
+    queue = get_prompt_queue()
+    monkeypatch.setattr(prompt_queue_module, 'prompt_queue', queue)
+    monkeypatch.setattr(worker_module, 'prompt_queue', queue)
+
+    async def idle(*args):
+        pass
+
+    async def send(chat_uid, message):
+        pass
+
+    # No Redis or providers in tests
+    monkeypatch.setattr(LLMWorker, 'listen_for_key_invalidations', idle)
+    monkeypatch.setattr(worker_module.model_catalog, 'run', idle)
+    monkeypatch.setattr(pubsub, 'send', send)
+    return queue
+
+
+@pytest.mark.django_db
+def test_enqueued_prompt_is_dispatched_by_the_worker(queue):
+    assert isinstance(queue, InProcessPromptQueue)
+    chat = Chat.objects.create(user=User.objects.create(username='queue@example.com'), model='dummy:dummy')
+
+    async def main():
+        worker = LLMWorker()
+        task = asyncio.create_task(worker.run())
+        await asyncio.sleep(0.2)  # past the startup sweep - the prompt can only come through the queue
+        prompt = await Prompt.objects.acreate(chat=chat, input_text='Hello', status='queued')
+        await aenqueue_prompt(prompt.id)
+        for _ in range(100):
+            await prompt.arefresh_from_db()
+            if prompt.status == 'finished':
+                break
+            await asyncio.sleep(0.05)
+        worker.stop()
+        await queue.aenqueue(0)  # wake the worker up, unknown prompt ids are skipped
+        await asyncio.wait_for(task, 5)
+        return prompt
+
+    prompt = async_to_sync(main)()
+    assert (prompt.status, prompt.result) == ('finished', 'success')
+    assert prompt.output_text
+
+
+def test_enqueue_error_is_logged_not_raised(monkeypatch, caplog):
+    class DownQueue(InProcessPromptQueue):
+        async def aenqueue(self, prompt_id: int):
+            raise redis.ConnectionError('Redis is down')
+
+    monkeypatch.setattr(prompt_queue_module, 'prompt_queue', DownQueue())
+    asyncio.run(aenqueue_prompt(1))
+    assert 'Error enqueueing prompt 1' in caplog.text
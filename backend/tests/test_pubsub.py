@@ -0,0 +1,73 @@
+import json
+import asyncio
+from chat.redis_pubsub import RedisPubSub
+
+
+class RecordingPipeline:
+    """Pipeline of RecordingConnection - the first execute is slow, like a round-trip on a busy connection."""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.messages = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    def publish(self, channel, data):
+        self.messages.append(json.loads(data))
+
+    async def execute(self):
+        self.connection.executions += 1
+        if self.connection.executions == 1:
+            await asyncio.sleep(0.05)
+        self.connection.published.extend(self.messages)
+
+
+class RecordingConnection:
+    def __init__(self):
+        self.published = []
+        self.executions = 0
+
+    def pipeline(self, transaction=True):
+        return RecordingPipeline(self)
+
+
+def create_pubsub(settings, batch_max_size=50) -> RedisPubSub:
+    settings.REDIS_PUBSUB_MODE = 'pubsub'
+    settings.REDIS_PUBLISH_BATCH_WINDOW = 0.01
+    settings.REDIS_PUBLISH_BATCH_MAX_SIZE = batch_max_size
+    pubsub = RedisPubSub()
+    pubsub._connection = RecordingConnection()
+    return pubsub
+
+
+def test_status_is_published_after_chunks_of_a_running_timer_flush(settings):
+    pubsub = create_pubsub(settings)
+
+    async def main():
+        await pubsub.publish_chunk('chat', 1, 'Hello')
+        await pubsub.publish_chunk('chat', 1, ' world')
+        await asyncio.sleep(0.02)  # the timer flush is writing the batch now
+        await pubsub.publish_status('chat', 1, 'finished')
+
+    asyncio.run(main())
+    assert [message['type'] for message in pubsub._connection.published] == ['chunks', 'status']
+
+
+def test_size_and_timer_flushes_keep_chunk_order(settings):
+    pubsub = create_pubsub(settings, batch_max_size=2)
+
+    async def main():
+        await pubsub.publish_chunk('chat', 1, 'a')
+        await asyncio.sleep(0.02)  # the timer flush is writing ['a'] now
+        for chunk in 'bc':
+            await pubsub.publish_chunk('chat', 1, chunk)  # size flush of ['b', 'c']
+        await pubsub.publish_status('chat', 1, 'finished')
+
+    asyncio.run(main())
+    chunks = [chunk for message in pubsub._connection.published for _prompt_id, chunk in message.get('chunks', [])]
+    assert chunks == ['a', 'b', 'c']
+    assert pubsub._connection.published[-1]['type'] == 'status'
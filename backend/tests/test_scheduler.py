@@ -0,0 +1,44 @@
+import asyncio
+import pytest
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from chat.models import Chat, Prompt
+from chat.worker import Job, LLMWorker, PromptScheduler
+
+
+def test_heavy_user_burst_does_not_starve_others():
+    finished = []
+
+    async def run_job(prompt_id):
+        await asyncio.sleep(0)
+        finished.append(prompt_id)
+
+    async def main():
+        scheduler = PromptScheduler(
+            run_job, max_running=1, max_per_user=1, max_per_provider=10, max_pending=500, max_pending_per_user=20
+        )
+        # Shared queue: user 1 queued 200 prompts before user 2 queued one - the worker drains it all
+        accepted = [scheduler.submit(Job(prompt_id, 1, 'dummy')) for prompt_id in range(1, 201)]
+        scheduler.submit(Job(1000, 2, 'dummy'))
+        assert accepted.count(True) == 21  # 1 running + 20 pending
+        assert scheduler.overflowed == {1}
+        while scheduler.running or scheduler.pending:
+            await asyncio.sleep(0)
+
+    asyncio.run(main())
+    assert finished.index(1000) <= 2
+
+
+@pytest.mark.django_db
+def test_sweep_submits_oldest_queued_prompts_per_user(settings):
+    settings.LLM_WORKER_MAX_PENDING_PER_USER = 5
+    settings.LLM_WORKER_MAX_RUNNING = 0  # only queue, don't run
+    heavy = Chat.objects.create(user=User.objects.create(username='heavy@example.com'), model='dummy:dummy')
+    light = Chat.objects.create(user=User.objects.create(username='light@example.com'), model='dummy:dummy')
+    heavy_ids = [Prompt.objects.create(chat=heavy, input_text=str(i)).id for i in range(30)]
+    light_id = Prompt.objects.create(chat=light, input_text='hi').id
+
+    worker = LLMWorker()
+    async_to_sync(worker.process_queued_prompts)()
+
+    assert worker.scheduler.pending_ids == set(heavy_ids[:5]) | {light_id}
@@ -0,0 +1,61 @@
+import io
+import pytest
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from ninja.errors import HttpError
+from chat.models import Upload
+from chat.uploads import part_path, receive_chunk
+
+
+class ChunkRequest(io.BytesIO):
+    def __init__(self, body: bytes, content_length: str | None):
+        super().__init__(body)
+        self.headers = {} if content_length is None else {'Content-Length': content_length}
+
+
+@pytest.fixture
+def upload(settings, tmp_path):
+    settings.UPLOAD_PARTS_DIR = tmp_path
+    settings.UPLOAD_CHUNK_MAX_SIZE = 100
+    user = User.objects.create(username='uploader@example.com')
+    upload = Upload.objects.create(user=user, filename='a.txt', size=150)
+    part_path(upload).touch()
+    return upload
+
+
+@pytest.mark.django_db
+def test_chunks_are_written_at_their_offset(upload):
+    async_to_sync(receive_chunk)(upload, ChunkRequest(b'a' * 100, '100'), 0)
+    async_to_sync(receive_chunk)(upload, ChunkRequest(b'b' * 50, '50'), 100)
+    upload.refresh_from_db()
+    assert upload.received == 150
+    assert part_path(upload).read_bytes() == b'a' * 100 + b'b' * 50
+
+
+@pytest.mark.django_db
+def test_chunk_without_content_length_is_rejected(upload):
+    with pytest.raises(HttpError) as error:
+        async_to_sync(receive_chunk)(upload, ChunkRequest(b'a' * 10, None), 0)
+    assert error.value.status_code == 411
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('content_length', ['abc', '-10', '1e3'])
+def test_invalid_content_length_is_rejected(upload, content_length):
+    with pytest.raises(HttpError) as error:
+        async_to_sync(receive_chunk)(upload, ChunkRequest(b'a' * 10, content_length), 0)
+    assert error.value.status_code == 400
+    upload.refresh_from_db()
+    assert upload.received == 0
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('body_size', [101, 5000])  # over the chunk limit / over the declared file size
+def test_body_longer_than_limits_is_not_stored(upload, body_size):
+    async_to_sync(receive_chunk)(upload, ChunkRequest(b'a' * 100, '100'), 0)
+    with pytest.raises(HttpError) as error:
+        async_to_sync(receive_chunk)(upload, ChunkRequest(b'b' * body_size, '10'), 100)
+    assert error.value.status_code == 413
+    upload.refresh_from_db()
+    assert upload.received == 100
+    assert part_path(upload).read_bytes() == b'a' * 100
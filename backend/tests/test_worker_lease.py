@@ -0,0 +1,47 @@
+import pytest
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from chat.models import Chat, Prompt
+from chat.redis_pubsub import pubsub
+from chat.worker import LLMWorker
+
+
+@pytest.fixture
+def prompt(settings, monkeypatch):
+    settings.PROMPT_FLUSH_INTERVAL = 0  # write on every chunk
+    sent = []
+
+    async def send(chat_uid, message):
+        sent.append(message)
+
+    monkeypatch.setattr(pubsub, 'send', send)
+    chat = Chat.objects.create(user=User.objects.create(username='lease@example.com'), model='dummy:dummy')
+    prompt = Prompt.objects.create(chat=chat, input_text='Hello')
+    prompt.sent = sent
+    return prompt
+
+
+@pytest.mark.django_db
+def test_prompt_runs_to_finished(prompt):
+    async_to_sync(LLMWorker().process_prompt)(prompt.id)
+    prompt.refresh_from_db()
+    assert (prompt.status, prompt.result) == ('finished', 'success')
+    assert prompt.output_text
+
+
+@pytest.mark.django_db
+def test_worker_stops_writing_after_losing_the_lease(prompt, monkeypatch):
+    send = pubsub.send
+
+    async def take_over_after_first_chunk(chat_uid, message):
+        await send(chat_uid, message)
+        if message['type'] == 'chunk':
+            # Lease expired, the reaper re-queued the prompt and another worker claimed it
+            await Prompt.objects.filter(id=prompt.id).aupdate(worker_id='other', output_text='other output')
+
+    monkeypatch.setattr(pubsub, 'send', take_over_after_first_chunk)
+    async_to_sync(LLMWorker().process_prompt)(prompt.id)
+
+    prompt.refresh_from_db()
+    assert (prompt.status, prompt.worker_id, prompt.output_text) == ('running', 'other', 'other output')
+    assert [m for m in prompt.sent if m['type'] == 'status'][-1]['status'] == 'running'
@@ -1,7 +1,9 @@
 from ninja import Router, Schema, ModelSchema
-from django.shortcuts import get_object_or_404
+from asgiref.sync import sync_to_async
+from django.shortcuts import aget_object_or_404
+from llms.clients import invalidate_api_keys
 from userprofile.models import SystemPrompt
-from userprofile.utils import get_userprofile_sync
+from userprofile.utils import get_userprofile
 
 
 router = Router()
@@ -28,53 +30,58 @@ class CreateSystemPromptSchema(Schema):
 
 
 @router.get("/profile", response=UserProfileResponseSchema)
-def get_profile(request):
+async def get_profile(request):
     """Get user profile with masked API keys."""
-    profile = get_userprofile_sync(request.auth)
+    profile = await get_userprofile(request.auth)
     return {"openai_key_set": bool(profile.openai_key), "openrouter_key_set": bool(profile.openrouter_key)}
 
 
 @router.patch("/profile")
-def update_profile(request, data: UserProfileSchema):
+async def update_profile(request, data: UserProfileSchema):
     """Update user profile API keys."""
-    profile = get_userprofile_sync(request.auth)
+    profile = await get_userprofile(request.auth)
+    old_keys = (profile.openai_key, profile.openrouter_key)
 
     if data.openai_key is not None:
         profile.openai_key = data.openai_key
     if data.openrouter_key is not None:
         profile.openrouter_key = data.openrouter_key
 
-    profile.save()
+    await profile.asave()
+
+    # Workers keep clients per API key - drop the ones of replaced keys
+    await sync_to_async(invalidate_api_keys)(
+        *(key for key in old_keys if key not in (profile.openai_key, profile.openrouter_key))
+    )
 
     return {"openai_key_set": bool(profile.openai_key), "openrouter_key_set": bool(profile.openrouter_key)}
 
 
 @router.get("/system-prompts", response=list[SystemPromptSchema])
-def list_system_prompts(request):
+async def list_system_prompts(request):
     """List user's system prompts."""
-    prompts = SystemPrompt.objects.filter(user=request.auth)
-    return list(prompts)
+    return [prompt async for prompt in SystemPrompt.objects.filter(user=request.auth)]
 
 
 @router.post("/system-prompts", response=SystemPromptSchema)
-def create_system_prompt(request, data: CreateSystemPromptSchema):
+async def create_system_prompt(request, data: CreateSystemPromptSchema):
     """Create a new system prompt."""
-    prompt = SystemPrompt.objects.create(user=request.auth, text=data.text)
+    prompt = await SystemPrompt.objects.acreate(user=request.auth, text=data.text)
     return prompt
 
 
 @router.put("/system-prompts/{prompt_id}", response=SystemPromptSchema)
-def update_system_prompt(request, prompt_id: int, data: CreateSystemPromptSchema):
+async def update_system_prompt(request, prompt_id: int, data: CreateSystemPromptSchema):
     """Update a system prompt."""
-    prompt = get_object_or_404(SystemPrompt, id=prompt_id, user=request.auth)
+    prompt = await aget_object_or_404(SystemPrompt, id=prompt_id, user=request.auth)
     prompt.text = data.text
-    prompt.save()
+    await prompt.asave()
     return prompt
 
 
 @router.delete("/system-prompts/{prompt_id}")
-def delete_system_prompt(request, prompt_id: int):
+async def delete_system_prompt(request, prompt_id: int):
     """Delete a system prompt."""
-    prompt = get_object_or_404(SystemPrompt, id=prompt_id, user=request.auth)
-    prompt.delete()
+    prompt = await aget_object_or_404(SystemPrompt, id=prompt_id, user=request.auth)
+    await prompt.adelete()
     return {"success": True}
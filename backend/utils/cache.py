@@ -1,24 +1,430 @@
 import time
+import json
+import pickle
+import asyncio
+import hashlib
+import datetime
 import functools
+import threading
+import inspect
+import redis
+import redis.asyncio as aioredis
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import Any, Callable, Optional
+from django.conf import settings
+from django.db.models import Model
+from django.utils.module_loading import import_string
 
 
 class CacheEntry:
-    def __init__(self, value: Any, timestamp: float):
+    def __init__(self, value: Any, fresh_until: float, stale_until: float):
         self.value = value
-        self.timestamp = timestamp
+        self.fresh_until = fresh_until  # returned as is until then
+        self.stale_until = stale_until  # then returned while one caller refreshes it
 
+    def is_fresh(self, now: float) -> bool:
+        return now < self.fresh_until
 
-# Global cache storage
-_cache_storage: dict[str, CacheEntry] = {}
+    def is_stale(self, now: float) -> bool:
+        return self.fresh_until <= now < self.stale_until
 
 
-def cache(ttl: int):
+class BaseCacheBackend:
+    """Storage of cache entries. Entries are kept for `timeout` seconds - expired ones are still
+    returned (as fallback when refreshing fails) until then.
+
+    Locks make sure only one process at a time loads a key. Async methods default to the sync ones.
     """
-    Cache decorator with TTL (time-to-live) support.
+
+    def get(self, key: str) -> CacheEntry | None:
+        raise NotImplementedError
+
+    def set(self, key: str, entry: CacheEntry, timeout: float):
+        raise NotImplementedError
+
+    def clear(self, prefix: str = ''):
+        """Drop entries of the function with this key prefix, or all entries."""
+        raise NotImplementedError
+
+    def lock(self, key: str, timeout: float) -> bool:
+        return True
+
+    def unlock(self, key: str):
+        pass
+
+    async def aget(self, key: str) -> CacheEntry | None:
+        return self.get(key)
+
+    async def aset(self, key: str, entry: CacheEntry, timeout: float):
+        self.set(key, entry, timeout)
+
+    async def alock(self, key: str, timeout: float) -> bool:
+        return self.lock(key, timeout)
+
+    async def aunlock(self, key: str):
+        self.unlock(key)
+
+
+def key_matches(key: str, prefix: str) -> bool:
+    return not prefix or key == prefix or key.startswith(prefix + ':')
+
+
+class MemoryCacheBackend(BaseCacheBackend):
+    """Per process LRU of up to CACHE_MAX_SIZE entries. Loads are already single-flight within the process."""
+
+    def __init__(self):
+        self.max_size = settings.CACHE_MAX_SIZE
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, tuple[CacheEntry, float]] = OrderedDict()  # key -> (entry, expires)
+
+    def get(self, key: str) -> CacheEntry | None:
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            entry, expires = item
+            if expires <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key: str, entry: CacheEntry, timeout: float):
+        with self._lock:
+            self._entries[key] = (entry, time.time() + timeout)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self, prefix: str = ''):
+        with self._lock:
+            for key in [key for key in self._entries if key_matches(key, prefix)]:
+                del self._entries[key]
+
+    def stats(self) -> dict:
+        return {'entries': len(self._entries), 'max_size': self.max_size}
+
+
+class RedisCacheBackend(BaseCacheBackend):
+    """Entries shared by all processes at REDIS_URL (values are pickled).
+
+    Redis errors are logged and treated as misses - the cached function is called instead.
+    """
+
+    prefix = 'cache:'
+
+    def __init__(self):
+        self.redis_url = settings.REDIS_URL
+        self._sync_connection = None
+        self._connection = None
+
+    def get_sync_connection(self):
+        if self._sync_connection is None:
+            self._sync_connection = redis.from_url(self.redis_url)
+        return self._sync_connection
+
+    def get_connection(self):
+        if self._connection is None:
+            self._connection = aioredis.from_url(self.redis_url)
+        return self._connection
+
+    def get(self, key: str) -> CacheEntry | None:
+        try:
+            data = self.get_sync_connection().get(self.prefix + key)
+        except redis.RedisError as e:
+            print(f"Error reading cache entry {key}: {e}")
+            return None
+        return pickle.loads(data) if data is not None else None
+
+    def set(self, key: str, entry: CacheEntry, timeout: float):
+        try:
+            self.get_sync_connection().set(self.prefix + key, pickle.dumps(entry), px=int(timeout * 1000))
+        except redis.RedisError as e:
+            print(f"Error writing cache entry {key}: {e}")
+
+    def clear(self, prefix: str = ''):
+        connection = self.get_sync_connection()
+        keys = [
+            key
+            for key in connection.scan_iter(match=f'{self.prefix}{prefix}*', count=1000)
+            if key_matches(key.decode()[len(self.prefix) :], prefix)
+        ]
+        if keys:
+            connection.delete(*keys)
+
+    def lock(self, key: str, timeout: float) -> bool:
+        try:
+            return bool(self.get_sync_connection().set(f'{self.prefix}lock:{key}', 1, nx=True, px=int(timeout * 1000)))
+        except redis.RedisError:
+            return True
+
+    def unlock(self, key: str):
+        try:
+            self.get_sync_connection().delete(f'{self.prefix}lock:{key}')
+        except redis.RedisError:
+            pass
+
+    async def aget(self, key: str) -> CacheEntry | None:
+        try:
+            data = await self.get_connection().get(self.prefix + key)
+        except redis.RedisError as e:
+            print(f"Error reading cache entry {key}: {e}")
+            return None
+        return pickle.loads(data) if data is not None else None
+
+    async def aset(self, key: str, entry: CacheEntry, timeout: float):
+        try:
+            await self.get_connection().set(self.prefix + key, pickle.dumps(entry), px=int(timeout * 1000))
+        except redis.RedisError as e:
+            print(f"Error writing cache entry {key}: {e}")
+
+    async def alock(self, key: str, timeout: float) -> bool:
+        try:
+            return bool(await self.get_connection().set(f'{self.prefix}lock:{key}', 1, nx=True, px=int(timeout * 1000)))
+        except redis.RedisError:
+            return True
+
+    async def aunlock(self, key: str):
+        try:
+            await self.get_connection().delete(f'{self.prefix}lock:{key}')
+        except redis.RedisError:
+            pass
+
+
+_backend: BaseCacheBackend | None = None
+
+
+def get_cache_backend() -> BaseCacheBackend:
+    global _backend
+    if _backend is None:
+        _backend = import_string(settings.CACHE_BACKEND)()
+    return _backend
+
+
+def _key_default(obj):
+    if isinstance(obj, Model):
+        return [obj._meta.label, obj.pk]
+    if isinstance(obj, (datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, (set, frozenset)):
+        return sorted(obj, key=repr)
+    raise TypeError(f"Can't use {type(obj).__name__} as a cache key argument")
+
+
+def make_key(prefix: str, args: tuple, kwargs: dict) -> str:
+    """Key that's the same in every process for equal arguments (JSON of the arguments, models by pk)."""
+    if not args and not kwargs:
+        return prefix
+    data = json.dumps([args, kwargs], sort_keys=True, separators=(',', ':'), default=_key_default)
+    return f'{prefix}:{hashlib.sha256(data.encode()).hexdigest()}'
+
+
+# Stale entries of sync functions are refreshed in these threads
+_refresh_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='cache-refresh')
+
+LOCK_TIMEOUT = 30  # seconds another process waits for a load before calling the function itself
+LOCK_POLL_INTERVAL = 0.05
+
+
+class CachedFunction:
+    """Loads, single-flight bookkeeping and stats of one decorated function."""
+
+    def __init__(self, func: Callable, ttl: float, stale: float):
+        self.func = func
+        self.ttl = ttl
+        self.stale = stale
+        self.prefix = f"{func.__module__}.{func.__qualname__}"
+        self.lock = threading.Lock()
+        self._loading: dict[str, Future] = {}  # sync loads in progress
+        self._tasks: dict[str, asyncio.Task] = {}  # async loads in progress
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    @property
+    def timeout(self) -> float:
+        """How long the backend keeps entries (for stale-while-revalidate and the error fallback)."""
+        return self.ttl + self.stale + settings.CACHE_STALE_IF_ERROR
+
+    def make_entry(self, value) -> CacheEntry:
+        now = time.time()
+        return CacheEntry(value, now + self.ttl, now + self.ttl + self.stale)
+
+    # Sync functions
+
+    def call(self, args, kwargs):
+        key = make_key(self.prefix, args, kwargs)
+        backend = get_cache_backend()
+        entry = backend.get(key)
+        now = time.time()
+        if entry is not None and entry.is_fresh(now):
+            self.hits += 1
+            return entry.value
+        if entry is not None and entry.is_stale(now):
+            self.stale_hits += 1
+            self.refresh_in_background(key, args, kwargs, entry)
+            return entry.value
+        self.misses += 1
+        return self.load(key, args, kwargs, entry)
+
+    def load(self, key, args, kwargs, fallback: CacheEntry | None):
+        """Call the function once per key however many threads ask for it at the same time."""
+        with self.lock:
+            future = self._loading.get(key)
+            owner = future is None
+            if owner:
+                future = self._loading[key] = Future()
+        if not owner:
+            return future.result()
+
+        try:
+            value = self.compute(key, args, kwargs)
+        except Exception as e:
+            self.errors += 1
+            if fallback is None:
+                future.set_exception(e)
+                raise
+            value = fallback.value  # expired value is better than none
+        finally:
+            with self.lock:
+                self._loading.pop(key, None)
+        future.set_result(value)
+        return value
+
+    def compute(self, key, args, kwargs):
+        backend = get_cache_backend()
+        acquired = backend.lock(key, LOCK_TIMEOUT)
+        if not acquired:
+            # Another process is loading it - wait for its result rather than calling the function too
+            deadline = time.monotonic() + LOCK_TIMEOUT
+            while time.monotonic() < deadline:
+                time.sleep(LOCK_POLL_INTERVAL)
+                entry = backend.get(key)
+                if entry is not None and entry.is_fresh(time.time()):
+                    return entry.value
+            # Its lock has expired by now - take it over unless another waiter was faster
+            acquired = backend.lock(key, LOCK_TIMEOUT)
+        try:
+            value = self.func(*args, **kwargs)
+            backend.set(key, self.make_entry(value), self.timeout)
+            return value
+        finally:
+            if acquired:  # never release a lock another process holds
+                backend.unlock(key)
+
+    def refresh_in_background(self, key, args, kwargs, stale: CacheEntry):
+        """Refresh a stale entry in a thread. Callers missing the key meanwhile wait for the refresh
+        and get its value, or the stale one if it fails or another process is refreshing it."""
+        with self.lock:
+            if key in self._loading:
+                return
+            future = self._loading[key] = Future()
+
+        def refresh():
+            value = stale.value
+            try:
+                backend = get_cache_backend()
+                if backend.lock(key, LOCK_TIMEOUT):  # else someone else is refreshing it already
+                    try:
+                        value = self.func(*args, **kwargs)
+                        backend.set(key, self.make_entry(value), self.timeout)
+                    finally:
+                        backend.unlock(key)
+            except Exception as e:
+                self.errors += 1
+                print(f"Error refreshing cache entry {key}: {e}")
+            finally:
+                with self.lock:
+                    self._loading.pop(key, None)
+                future.set_result(value)
+
+        _refresh_executor.submit(refresh)
+
+    # Async functions
+
+    async def acall(self, args, kwargs):
+        key = make_key(self.prefix, args, kwargs)
+        backend = get_cache_backend()
+        entry = await backend.aget(key)
+        now = time.time()
+        if entry is not None and entry.is_fresh(now):
+            self.hits += 1
+            return entry.value
+        if entry is not None and entry.is_stale(now):
+            self.stale_hits += 1
+            self.start_task(key, args, kwargs)
+            return entry.value
+        self.misses += 1
+        task = self.start_task(key, args, kwargs)
+        try:
+            # Shielded - a cancelled caller doesn't cancel the load others are waiting for
+            return await asyncio.shield(task)
+        except Exception:
+            if entry is None:
+                raise
+            return entry.value
+
+    def start_task(self, key, args, kwargs) -> asyncio.Task:
+        loop = asyncio.get_running_loop()
+        task = self._tasks.get(key)
+        if task is not None and task.get_loop() is loop:
+            return task
+        task = loop.create_task(self.acompute(key, args, kwargs))
+        self._tasks[key] = task
+
+        def done(task):
+            if self._tasks.get(key) is task:
+                del self._tasks[key]
+            if not task.cancelled() and task.exception() is not None:
+                self.errors += 1
+                print(f"Error loading cache entry {key}: {task.exception()}")
+
+        task.add_done_callback(done)
+        return task
+
+    async def acompute(self, key, args, kwargs):
+        backend = get_cache_backend()
+        acquired = await backend.alock(key, LOCK_TIMEOUT)
+        if not acquired:
+            deadline = time.monotonic() + LOCK_TIMEOUT
+            while time.monotonic() < deadline:
+                await asyncio.sleep(LOCK_POLL_INTERVAL)
+                entry = await backend.aget(key)
+                if entry is not None and entry.is_fresh(time.time()):
+                    return entry.value
+            acquired = await backend.alock(key, LOCK_TIMEOUT)
+        try:
+            value = await self.func(*args, **kwargs)
+            await backend.aset(key, self.make_entry(value), self.timeout)
+            return value
+        finally:
+            if acquired:
+                await backend.aunlock(key)
+
+    def stats(self) -> dict:
+        return {
+            'hits': self.hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+            'errors': self.errors,
+            'loading': len(self._loading) + len(self._tasks),
+        }
+
+
+def cache(ttl: int, stale: int = 0):
+    """
+    Cache decorator with TTL (time-to-live) support, for sync and async functions.
 
     Args:
         ttl: Time to live in seconds
+        stale: Seconds after the TTL during which the old value is still returned
+            while it's refreshed in the background (stale-while-revalidate)
+
+    Concurrent calls with the same arguments share one call of the function (also across processes
+    with the Redis backend). If the call fails, an expired value is returned when there is one.
+    Arguments must be JSON serializable (or model instances) to build the key.
 
     Usage:
         @cache(ttl=30*60)  # 30 minutes
@@ -27,29 +433,21 @@ def cache(ttl: int):
     """
 
     def decorator(func: Callable) -> Callable:
-        @functools.wraps(func)
-        def wrapper(*args, **kwargs) -> Any:
-            # Create cache key from function name and arguments
-            cache_key = f"{func.__module__}.{func.__name__}:{hash(str(args) + str(sorted(kwargs.items())))}"
-            current_time = time.time()
-
-            # Check if we have valid cached data
-            if cache_key in _cache_storage:
-                entry = _cache_storage[cache_key]
-                if current_time - entry.timestamp < ttl:
-                    return entry.value
+        cached = CachedFunction(func, ttl, stale)
 
-            # Call the function and cache the result
-            try:
-                result = func(*args, **kwargs)
-                _cache_storage[cache_key] = CacheEntry(result, current_time)
-                return result
-            except Exception as e:
-                # If function fails and we have expired cache, return it as fallback
-                if cache_key in _cache_storage:
-                    return _cache_storage[cache_key].value
-                raise e
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs) -> Any:
+                return await cached.acall(args, kwargs)
+
+        else:
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs) -> Any:
+                return cached.call(args, kwargs)
 
+        wrapper.cache = cached
         return wrapper
 
     return decorator
@@ -63,10 +461,6 @@ def clear_cache(func: Optional[Callable] = None) -> None:
         func: Function to clear cache for, or None to clear all cache
     """
     if func is None:
-        _cache_storage.clear()
+        get_cache_backend().clear()
     else:
-        # Remove all cache entries for this function
-        prefix = f"{func.__module__}.{func.__name__}:"
-        keys_to_remove = [key for key in _cache_storage.keys() if key.startswith(prefix)]
-        for key in keys_to_remove:
-            del _cache_storage[key]
+        get_cache_backend().clear(func.cache.prefix)
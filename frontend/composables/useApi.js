@@ -1,3 +1,5 @@
+const RESUMABLE_UPLOAD_SIZE = 8 * 1024 * 1024
+
 class Api {
   constructor(baseURL) {
     this.baseURL = baseURL
@@ -24,8 +26,10 @@ class Api {
     return await resp.json()
   }
 
-  async getChats() {
-    const resp = await fetch(`${this.baseURL}/chats`, {
+  async getChats(params = {}) {
+    // params: { limit, after } - `after` is the `cursor` of the last loaded chat
+    const query = new URLSearchParams(params).toString()
+    const resp = await fetch(`${this.baseURL}/chats${query ? `?${query}` : ''}`, {
         method: 'GET',
         headers: this.getAuthHeaders(),
     })
@@ -41,8 +45,10 @@ class Api {
     return await resp.json()
   }
 
-  async getChat(uid) {
-    const resp = await fetch(`${this.baseURL}/chats/${uid}`, {
+  async getChat(uid, params = {}) {
+    // params: { limit, before } - window of latest prompts / older page
+    const query = new URLSearchParams(params).toString()
+    const resp = await fetch(`${this.baseURL}/chats/${uid}${query ? `?${query}` : ''}`, {
         method: 'GET',
         headers: this.getAuthHeaders(),
     })
@@ -66,6 +72,18 @@ class Api {
     return await resp.json()
   }
 
+  async searchModels(params = {}) {
+    // params: { q, provider, min_context_length, max_prompt_price, limit, offset }
+    const query = new URLSearchParams(
+      Object.entries(params).filter(([, value]) => value !== undefined && value !== null && value !== '')
+    ).toString()
+    const resp = await fetch(`${this.baseURL}/models/search${query ? `?${query}` : ''}`, {
+        method: 'GET',
+        headers: this.getAuthHeaders(),
+    })
+    return await resp.json()
+  }
+
   async getTools() {
     const resp = await fetch(`${this.baseURL}/tools`, {
         method: 'GET',
@@ -189,6 +207,11 @@ class Api {
   }
 
   async uploadFile(file) {
+    // Big files go in resumable chunks
+    if (file.size > RESUMABLE_UPLOAD_SIZE) {
+      return await this.uploadFileInChunks(file)
+    }
+
     const formData = new FormData()
     formData.append('file', file)
     
@@ -199,7 +222,67 @@ class Api {
         },
         body: formData
     })
-    return await resp.json()
+    return await this.uploadResult(resp)
+  }
+
+  async uploadFileInChunks(file) {
+    const resp = await fetch(`${this.baseURL}/chats/files/uploads`, {
+        method: 'POST',
+        headers: this.getAuthHeaders(),
+        body: JSON.stringify({ filename: file.name, size: file.size, media_type: file.type })
+    })
+    let upload = await this.uploadResult(resp)
+
+    let retries = 0
+    while (upload.received < upload.size) {
+      const chunk = file.slice(upload.received, upload.received + upload.chunk_size)
+      try {
+        const chunkResp = await fetch(`${this.baseURL}/chats/files/uploads/${upload.uid}?offset=${upload.received}`, {
+            method: 'PUT',
+            headers: {
+                'Authorization': this.getAuthHeaders()['Authorization'],
+                'Content-Type': 'application/octet-stream'
+            },
+            body: chunk
+        })
+        upload = await this.uploadResult(chunkResp)
+        retries = 0
+      } catch (error) {
+        if (++retries > 3) throw error
+        // Resume from what the server actually got
+        const statusResp = await fetch(`${this.baseURL}/chats/files/uploads/${upload.uid}`, {
+            headers: this.getAuthHeaders()
+        })
+        upload = await this.uploadResult(statusResp)
+      }
+    }
+
+    const completeResp = await fetch(`${this.baseURL}/chats/files/uploads/${upload.uid}/complete`, {
+        method: 'POST',
+        headers: this.getAuthHeaders()
+    })
+    return await this.uploadResult(completeResp)
+  }
+
+  async fileUrl(fileId) {
+    // Short-lived signed link - used as link/src, where headers can't be set
+    const resp = await fetch(`${this.baseURL}/chats/files/${fileId}/url`, {
+        method: 'POST',
+        headers: this.getAuthHeaders(),
+    })
+    const data = await resp.json()
+    if (!resp.ok) {
+      throw new Error(data.detail || `Failed to open file (${resp.status})`)
+    }
+    return data.url
+  }
+
+  async uploadResult(resp) {
+    const data = await resp.json()
+    if (!resp.ok) {
+      throw new Error(data.detail || `Upload failed (${resp.status})`)
+    }
+    return data
   }
 
   logout() {
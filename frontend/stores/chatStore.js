@@ -1,8 +1,12 @@
 import { reactive } from 'vue'
 import { useApi } from '~/composables/useApi'
 
+// Number of chats loaded per sidebar page
+const CHATS_PAGE_SIZE = 50
+
 export const store = reactive({
   chats: [],
+  hasMoreChats: false,
   models: [],
   systemPrompts: [],
   tools: [],
@@ -10,12 +14,33 @@ export const store = reactive({
   async loadChats() {
     try {
       const api = useApi()
-      this.chats = await api.getChats()
+      const chats = await api.getChats({ limit: CHATS_PAGE_SIZE })
+      // Keep older pages that were already loaded
+      const loaded = new Set(chats.map(chat => chat.uid))
+      const last = chats[chats.length - 1]
+      const older = last ? this.chats.filter(chat => !loaded.has(chat.uid) && chat.id < last.id) : []
+      this.chats = [...chats, ...older]
+      if (!older.length) {
+        this.hasMoreChats = chats.length === CHATS_PAGE_SIZE
+      }
     } catch (error) {
       console.error('Failed to load chats:', error)
     }
   },
 
+  async loadMoreChats() {
+    if (!this.chats.length) return
+    try {
+      const api = useApi()
+      const after = this.chats[this.chats.length - 1].cursor
+      const chats = await api.getChats({ limit: CHATS_PAGE_SIZE, after })
+      this.chats = [...this.chats, ...chats]
+      this.hasMoreChats = chats.length === CHATS_PAGE_SIZE
+    } catch (error) {
+      console.error('Failed to load more chats:', error)
+    }
+  },
+
   async loadModels() {
     try {
       const api = useApi()